@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+from metrics import counter, histogram
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+# Extra slots only cheap requests (general replies, FAQ and cache hits) may use
+ADMISSION_CHEAP_RESERVE = int(os.getenv("ADMISSION_CHEAP_RESERVE", "16"))
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory, redis or off
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Proxies in front of the app that append to X-Forwarded-For: 1 for the App
+# Service front end, 0 when clients connect directly
+RATE_LIMIT_PROXY_HOPS = int(os.getenv("RATE_LIMIT_PROXY_HOPS", "1"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+ADMISSION_DECISIONS = counter(
+    "admission_requests_total",
+    "Admission decisions by lane (cheap or full) and outcome",
+)
+ADMISSION_WAIT_SECONDS = histogram(
+    "admission_wait_seconds",
+    "Time admitted requests spent queued for a slot",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+class AdmissionRejected(Exception):
+    """The request was shed; retry_after is a hint in seconds"""
+
+    status_code = 503
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimited(AdmissionRejected):
+    """The client used up its token bucket"""
+
+    status_code = 429
+
+
+class Ticket:
+    """One admitted unit of work, handed back to release()"""
+
+    def __init__(self, cheap: bool, weight: int):
+        self.cheap = cheap
+        self.weight = weight
+        self.queued_at = time.perf_counter()
+        self.granted_at: Optional[float] = None
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Bounded in-flight work with a bounded, deadline-aware wait queue
+
+    A request runs at once while fewer than max_in_flight slots are taken
+    and nobody is queued ahead of it. Otherwise it waits, unless the queue
+    is full or its expected wait, estimated from recent service times,
+    would already overrun its deadline; both are rejected straight away
+    rather than after a timeout. Cheap requests have their own queue that is
+    served first, may use cheap_reserve extra slots and, when the queue is
+    full, displace the newest full request.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_wait: float = ADMISSION_MAX_WAIT_SECONDS,
+                 cheap_reserve: int = ADMISSION_CHEAP_RESERVE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.cheap_reserve = cheap_reserve
+        self.in_flight = 0
+        self.service_time = 1.0  # moving average of full requests, in seconds
+        self._queues = {True: deque(), False: deque()}  # cheap, full
+
+    @property
+    def queued(self) -> int:
+        return len(self._queues[True]) + len(self._queues[False])
+
+    def _limit(self, cheap: bool) -> int:
+        return self.max_in_flight + (self.cheap_reserve if cheap else 0)
+
+    def _ahead(self, cheap: bool) -> int:
+        return len(self._queues[True]) if cheap else self.queued
+
+    def estimated_wait(self, position: int) -> float:
+        """Expected seconds until `position` queued requests and this one get a slot"""
+        return self.service_time * (position + 1) / self.max_in_flight
+
+    def _reject(self, lane: str, outcome: str, reason: str, retry_after: float) -> AdmissionRejected:
+        ADMISSION_DECISIONS.inc(lane=lane, outcome=outcome)
+        logger.warning(f"Shedding {lane} request: {reason}")
+        return AdmissionRejected(reason, retry_after)
+
+    def _grant(self, ticket: Ticket) -> Ticket:
+        self.in_flight += ticket.weight
+        ticket.granted_at = time.perf_counter()
+        lane = "cheap" if ticket.cheap else "full"
+        ADMISSION_WAIT_SECONDS.observe(ticket.granted_at - ticket.queued_at, lane=lane)
+        ADMISSION_DECISIONS.inc(lane=lane, outcome="admitted")
+        return ticket
+
+    async def acquire(self, cheap: bool = False, weight: int = 1,
+                      timeout: Optional[float] = None) -> Ticket:
+        """Wait for a slot; raises AdmissionRejected if the request is shed"""
+        lane = "cheap" if cheap else "full"
+        weight = max(1, min(weight, self.max_in_flight))
+        timeout = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        ticket = Ticket(cheap, weight)
+
+        ahead = self._ahead(cheap)
+        if not ahead and self.in_flight + weight <= self._limit(cheap):
+            return self._grant(ticket)
+
+        if self.queued >= self.max_queue:
+            if not cheap or not self._queues[False]:
+                raise self._reject(lane, "queue_full", f"queue full ({self.queued} waiting)",
+                                   self.estimated_wait(self.queued))
+            # Make room by shedding the full request that arrived last
+            _victim, victim_future = self._queues[False].pop()
+            if not victim_future.done():
+                victim_future.set_exception(self._reject(
+                    "full", "displaced", "displaced by a cheap request", self.estimated_wait(self.queued)
+                ))
+            ahead = self._ahead(cheap)
+
+        expected = self.estimated_wait(ahead)
+        if not cheap and expected > timeout:
+            raise self._reject(lane, "deadline", f"expected wait {expected:.1f}s exceeds {timeout:.1f}s",
+                               expected)
+
+        future = asyncio.get_event_loop().create_future()
+        entry: Tuple[Ticket, asyncio.Future] = (ticket, future)
+        self._queues[cheap].append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except BaseException as e:
+            if entry in self._queues[cheap]:
+                self._queues[cheap].remove(entry)
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the caller gave up; hand the slot on
+                self.release(ticket)
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(lane, "timeout", f"no slot within {timeout:.1f}s",
+                                   self.estimated_wait(self.queued))
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """Return a ticket's slots and admit whoever is next; repeated calls are no-ops"""
+        if ticket.released:
+            return
+        ticket.released = True
+        self.in_flight -= ticket.weight
+        if not ticket.cheap and ticket.granted_at is not None:
+            elapsed = time.perf_counter() - ticket.granted_at
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for cheap in (True, False):
+            queue: Deque = self._queues[cheap]
+            while queue:
+                ticket, future = queue[0]
+                if future.done():
+                    queue.popleft()
+                    continue
+                if self.in_flight + ticket.weight > self._limit(cheap):
+                    break
+                queue.popleft()
+                future.set_result(self._grant(ticket))
+
+    @asynccontextmanager
+    async def slot(self, cheap: bool = False, weight: int = 1, timeout: Optional[float] = None):
+        """Hold a slot for the duration of the block"""
+        ticket = await self.acquire(cheap, weight, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "service_time_s": round(self.service_time, 3),
+        }
+
+
+class InMemoryRateLimiter:
+    """Per-client token buckets in this process, least recently seen evicted first"""
+
+    def __init__(self, per_minute: float, burst: float, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, cost: float = 1) -> float:
+        """Spend cost tokens; 0 if allowed, else seconds until they are available"""
+        # A cost above the burst could never be paid; it drains the bucket instead
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            retry_after = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                retry_after = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+# Refill and spend atomically, so every worker and replica shares one bucket
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = math.min(tonumber(ARGV[4]), burst)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimiter:
+    """Token buckets in Redis, updated by one Lua script per request"""
+
+    def __init__(self, url: str, per_minute: float, burst: float, prefix: str = "ratelimit"):
+        import redis.asyncio as redis
+
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key: str, cost: float = 1) -> float:
+        try:
+            retry_after = await self._script(
+                keys=[f"{self.prefix}:{key}"], args=[self.rate, self.burst, time.time(), cost]
+            )
+            return float(retry_after)
+        except Exception as e:
+            # Fail open: an unreachable Redis should not take the chat down
+            logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+            return 0.0
+
+
+class NullRateLimiter:
+    async def take(self, key: str, cost: float = 1) -> float:
+        return 0.0
+
+
+def strip_port(address: str) -> str:
+    """"1.2.3.4:5678" or "[::1]:5678" without the port; some front ends add one"""
+    if address.startswith("["):
+        return address[1:].split("]", 1)[0]
+    if address.count(":") == 1:
+        return address.split(":", 1)[0]
+    return address
+
+
+def client_key(host: Optional[str], forwarded_for: Optional[str] = None,
+               proxy_hops: int = RATE_LIMIT_PROXY_HOPS) -> str:
+    """
+    Rate limit key of a client: the right-most X-Forwarded-For address not added by our proxies
+
+    Each of the proxy_hops trusted proxies appends the address it received
+    the request from, so that entry is the first one a client cannot forge.
+    Behind a proxy the socket address is the proxy's, shared by every user.
+    """
+    if proxy_hops > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if hops:
+            return strip_port(hops[-min(proxy_hops, len(hops))])
+    return host or "unknown"
+
+
+async def check_rate_limit(key: str, cost: float = 1) -> None:
+    """Raise RateLimited if the client has no tokens left"""
+    retry_after = await get_rate_limiter().take(key, cost)
+    if retry_after > 0:
+        ADMISSION_DECISIONS.inc(lane="any", outcome="rate_limited")
+        logger.warning(f"Rate limited {key} for {retry_after:.1f}s")
+        raise RateLimited(f"rate limit of {RATE_LIMIT_PER_MINUTE:g} requests per minute exceeded",
+                          retry_after)
+
+
+_controller: Optional[AdmissionController] = None
+_rate_limiter = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter for the configured backend"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        if RATE_LIMIT_BACKEND == "off":
+            _rate_limiter = NullRateLimiter()
+        elif RATE_LIMIT_BACKEND == "redis":
+            _rate_limiter = RedisRateLimiter(REDIS_URL, RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+        else:
+            _rate_limiter = InMemoryRateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+        logger.info(f"Rate limiter backend: {RATE_LIMIT_BACKEND}")
+    return _rate_limiter
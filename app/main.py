@@ -1,13 +1,25 @@
 import asyncio
 asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from app.models import ChatMessage, ChatResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from admission import AdmissionRejected, Ticket, check_rate_limit, client_key, get_admission_controller
+from circuit_breaker import get_llm_breaker
+from index_versions import clear_serving, current_version
+from app.models import ChatBatchRequest, ChatBatchResponse, ChatMessage, ChatResponse
+from metrics import StageTimer, render_prometheus
+from llm_client import LLMOverloadedError, close_llm_client, get_llm_client
+from warmup import get_warmup
 import traceback
 import logging
+import hmac
+import json
+import os
 from datetime import datetime
+import math
+from typing import Dict, List, Optional, Tuple
 
 # Configure logging with timestamp
 logging.basicConfig(
@@ -39,21 +51,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Lazy load query_rag
+# Required by the admin endpoints; they are disabled while unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Loaded by the background warmup
 query_rag = None
+query_rag_batch = None
+stream_query_rag = None
+is_cheap_query = None
+route_query = None
+QUERY_BATCH_CONCURRENCY = 1
+
+
+def publish_handlers():
+    """Bind the query handlers once warmup has imported them"""
+    global query_rag, query_rag_batch, stream_query_rag, is_cheap_query, route_query, QUERY_BATCH_CONCURRENCY
+    from query_data import (
+        QUERY_BATCH_CONCURRENCY, is_cheap_query, query_rag, query_rag_batch, route_query, stream_query_rag
+    )
+
+
+async def warm_up():
+    """Import the query pipeline and load the model in the background"""
+    warmup = get_warmup()
+    await warmup.start()
+    if warmup.ready:
+        publish_handlers()
+        # Every worker watches for new index versions on its own
+        from retrieval_context import INDEX_WATCH_SECONDS, watch_index_versions
+        if INDEX_WATCH_SECONDS > 0:
+            app.state.index_watch_task = asyncio.ensure_future(watch_index_versions())
+
+
+async def ensure_ready():
+    """Hold a request until warmup finishes; 503 if it failed or is too slow"""
+    if query_rag is not None:
+        return
+    if not await get_warmup().wait_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="The assistant is starting up. Please try again shortly.",
+            headers={"Retry-After": "5"}
+        )
+    publish_handlers()
 
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize application components on startup"""
+    """Start warming up in the background so the server listens immediately"""
     logger.info("Starting application...")
-    try:
-        # Add any startup initialization here
-        logger.info("Application started successfully")
-    except Exception as e:
-        logger.error(f"Startup failed: {str(e)}")
-        logger.error(traceback.format_exc())
-        raise
+    # Keep a reference so the task is not garbage collected
+    app.state.warmup_task = asyncio.ensure_future(warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled connections on shutdown"""
+    watch_task = getattr(app.state, "index_watch_task", None)
+    if watch_task is not None:
+        watch_task.cancel()
+        # Let collect_garbage delete our version once it is retired
+        clear_serving()
+    await close_llm_client()
 
 
 @app.get("/")
@@ -66,43 +125,137 @@ async def read_root():
     }
 
 
+def overloaded_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="The assistant is busy right now. Please try again shortly.",
+        headers={"Retry-After": "1"}
+    )
+
+
+def shed_error(e: AdmissionRejected) -> HTTPException:
+    if e.status_code == 429:
+        detail = "Too many requests. Please slow down and try again shortly."
+    else:
+        detail = "The assistant is busy right now. Please try again shortly."
+    return HTTPException(
+        status_code=e.status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+    )
+
+
+async def admit(request: Request, messages: List[str]) -> Tuple[Ticket, List]:
+    """
+    Rate limit the client, route the messages, then wait for an admission slot
+
+    Queries answered without retrieval or the LLM are admitted first, so
+    they keep flowing while full queries queue or are shed. Returns the
+    ticket and each message's RouteDecision, which the endpoint hands on so
+    every query is classified once.
+    """
+    try:
+        key = client_key(request.client.host if request.client else None,
+                         request.headers.get("x-forwarded-for"))
+        await check_rate_limit(key, cost=len(messages))
+        routes = [route_query(text) for text in messages]
+        cheap = True
+        for text, route in zip(messages, routes):
+            if not await is_cheap_query(text, route):
+                cheap = False
+                break
+        # A batch runs up to QUERY_BATCH_CONCURRENCY queries at once
+        weight = min(len(messages), QUERY_BATCH_CONCURRENCY)
+        return await get_admission_controller().acquire(cheap, weight=weight), routes
+    except AdmissionRejected as e:
+        raise shed_error(e)
+
+
+def to_chat_response(result, include_timings: bool, extra_timings: Dict[str, float]) -> ChatResponse:
+    """Serialize a QueryResponse and log its stage timings"""
+    timings = dict(result.timings)
+    timings.update(extra_timings)
+    logger.info(
+        "Stage timings (ms): "
+        + ", ".join(f"{name}={seconds * 1000:.1f}" for name, seconds in timings.items())
+    )
+    return ChatResponse(
+        response=result.text,
+        sources=result.sources,
+        scores=result.scores,
+        route=result.route.to_dict() if result.route is not None else None,
+        cache=result.cache,
+        timings_ms={name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+        if include_timings else None
+    )
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(message: ChatMessage):
+async def chat_endpoint(message: ChatMessage, request: Request):
     """
     Process chat messages and return responses
     """
     try:
-        global query_rag
-        if query_rag is None:
-            logger.info("Lazy loading query_rag...")
-            from query_data import query_rag
-
         # Log received message
         logger.info(f"Received message: {message.message}")
 
+        await ensure_ready()
+
         # Call query_rag and await its response
-        response_text = await query_rag(message.message)
-        logger.info(f"Raw response: {response_text}")
-
-        # Parse the response
-        parts = response_text.split("\nSources: ")
-        main_response = parts[0].replace("Response: ", "").strip()
-
-        # Safely parse sources
-        sources = []
-        if len(parts) > 1:
-            try:
-                sources_str = parts[1].strip("[]").replace("'", "").replace('"', "")
-                sources = [s.strip() for s in sources_str.split(",") if s.strip()]
-            except Exception as e:
-                logger.warning(f"Error parsing sources: {str(e)}")
-
-        # Return properly formatted response
-        return ChatResponse(
-            response=main_response,
-            sources=sources
+        timer = StageTimer()
+        with timer.stage("admission"):
+            ticket, routes = await admit(request, [message.message])
+        try:
+            with timer.stage("total"):
+                result = await query_rag(message.message, routes[0])
+        except LLMOverloadedError as e:
+            logger.warning(f"Shedding chat request: {str(e)}")
+            raise overloaded_error()
+        finally:
+            get_admission_controller().release(ticket)
+        logger.debug(f"Response: {result.text}")
+        get_warmup().record_first_chat()
+
+        return to_chat_response(result, message.include_timings, timer.timings)
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error("Error occurred:")
+        logger.error(traceback.format_exc())
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
         )
 
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch_endpoint(batch: ChatBatchRequest, request: Request):
+    """
+    Answer several chat messages in one request, in order
+    """
+    try:
+        logger.info(f"Received batch of {len(batch.messages)} messages")
+        await ensure_ready()
+
+        ticket, routes = await admit(request, batch.messages)
+        try:
+            results = await query_rag_batch(batch.messages, routes)
+        except LLMOverloadedError as e:
+            logger.warning(f"Shedding chat batch: {str(e)}")
+            raise overloaded_error()
+        finally:
+            get_admission_controller().release(ticket)
+        get_warmup().record_first_chat()
+
+        return ChatBatchResponse(
+            responses=[to_chat_response(result, batch.include_timings, {}) for result in results]
+        )
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         logger.error("Error occurred:")
         logger.error(traceback.format_exc())
@@ -112,10 +265,84 @@ async def chat_endpoint(message: ChatMessage):
         )
 
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(message: ChatMessage, request: Request):
+    """
+    Process chat messages and stream the response as server-sent events
+    """
+    logger.info(f"Received streaming message: {message.message}")
+    await ensure_ready()
+    ticket, routes = await admit(request, [message.message])
+    controller = get_admission_controller()
+    if not ticket.cheap and get_llm_client().overloaded:
+        controller.release(ticket)
+        raise overloaded_error()
+
+    async def event_stream():
+        try:
+            async for event in stream_query_rag(message.message, route=routes[0]):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            controller.release(ticket)
+
+    # The background task also frees the slot if the stream never starts
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(controller.release, ticket)
+    )
+
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
+    """
+    Health check endpoint; startup is warming, ready or failed
+
+    A failed warmup is never retried, so it answers 503 for the platform's
+    probe to restart the worker instead of serving 503 to every chat.
+    """
+    warmup = get_warmup()
+    failed = warmup.state == "failed"
+    health = {
+        "status": "unhealthy" if failed else "healthy",
+        "ready": warmup.ready and query_rag is not None,
+        "startup": warmup.state,
+        "admission": get_admission_controller().stats(),
+        "llm_breaker": get_llm_breaker().stats(),
         "timestamp": datetime.utcnow().isoformat()
-    }
\ No newline at end of file
+    }
+    if warmup.error:
+        health["startup_error"] = warmup.error
+    if warmup.ready:
+        from retrieval_context import get_retrieval_context
+        health["index"] = {"serving": get_retrieval_context().version, "published": current_version()}
+    if failed:
+        return JSONResponse(status_code=503, content=health)
+    return health
+
+
+@app.post("/admin/reload-index")
+async def reload_index_endpoint(x_admin_token: Optional[str] = Header(None)):
+    """Switch this worker to the newest published index version without a restart"""
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    await ensure_ready()
+    from retrieval_context import get_retrieval_context, reload_retrieval_context
+    try:
+        loop = asyncio.get_event_loop()
+        reloaded = await loop.run_in_executor(None, reload_retrieval_context)
+    except Exception as e:
+        logger.error(f"Index reload failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Index reload failed: {str(e)}")
+    return {"reloaded": reloaded, "version": get_retrieval_context().version}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus metrics endpoint"""
+    return PlainTextResponse(
+        render_prometheus(),
+        media_type="text/plain; version=0.0.4"
+    )
@@ -1,9 +1,23 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+
+CHAT_BATCH_MAX_SIZE = 32
 
 class ChatMessage(BaseModel):
     message: str
+    include_timings: bool = False
 
 class ChatResponse(BaseModel):
     response: str
-    sources: Optional[List[str]] = None
\ No newline at end of file
+    sources: Optional[List[str]] = None
+    scores: Optional[List[float]] = None
+    route: Optional[Dict[str, Optional[str]]] = None
+    cache: Optional[str] = None
+    timings_ms: Optional[Dict[str, float]] = None
+
+class ChatBatchRequest(BaseModel):
+    messages: List[str] = Field(..., min_length=1, max_length=CHAT_BATCH_MAX_SIZE)
+    include_timings: bool = False
+
+class ChatBatchResponse(BaseModel):
+    responses: List[ChatResponse]
@@ -0,0 +1,146 @@
+"""
+Load test for the chat endpoints.
+
+Replays a query corpus at a fixed concurrency and reports p50/p95/p99 latency,
+throughput and error rate overall and per query kind. By default the FastAPI
+app runs in-process with the LLM replaced by FakeLLMClient, so the numbers
+isolate our own overhead; pass --url to drive a running server instead (start
+it with LLAMA_API_URL pointing at benchmarks/fake_llm_server.py).
+
+    python -m benchmarks.bench_chat --concurrency 16 --requests 500 --llm-latency 0.5
+    python -m benchmarks.bench_chat --url http://localhost:8000 --corpus test.http
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.common import DEFAULT_CORPUS, latency_summary, load_corpus, print_report, save_results
+
+
+async def run_load(client, queries: List[Dict], endpoint: str, concurrency: int,
+                   total_requests: int) -> Dict:
+    """Send total_requests queries from concurrency workers and summarize"""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    statuses: Dict[int, int] = defaultdict(int)
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total_requests:
+            query = queries[next_index % len(queries)]
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json={"message": query["message"]})
+                await response.aread()
+                status = response.status_code
+            except Exception:
+                status = 0
+            elapsed = time.perf_counter() - start
+
+            statuses[status] += 1
+            if status == 200:
+                latencies[query["kind"]].append(elapsed)
+                latencies["all"].append(elapsed)
+            else:
+                errors[query["kind"]] += 1
+                errors["all"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall_time = time.perf_counter() - start
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "wall_time_s": wall_time,
+        "throughput_rps": total_requests / wall_time if wall_time else 0.0,
+        "error_rate": errors["all"] / total_requests if total_requests else 0.0,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "latency": {kind: latency_summary(values) for kind, values in sorted(latencies.items())},
+        "errors": dict(errors),
+    }
+
+
+async def run_in_process(args, queries: List[Dict]) -> Dict:
+    import httpx
+
+    from benchmarks.fake_llm_server import FakeLLMClient
+    from llm_client import set_llm_client
+
+    fake_llm = FakeLLMClient(latency=args.llm_latency, token_delay=args.token_delay)
+    set_llm_client(fake_llm)
+
+    from app.main import app, shutdown_event, startup_event
+    from warmup import get_warmup
+    await startup_event()
+    if not await get_warmup().wait_ready():
+        raise SystemExit("App warmup failed")
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if args.warmup:
+                await run_load(client, queries, args.endpoint, min(args.concurrency, args.warmup), args.warmup)
+            results = await run_load(client, queries, args.endpoint, args.concurrency, args.requests)
+    finally:
+        await shutdown_event()
+    results["mode"] = "in-process"
+    results["llm_latency_s"] = args.llm_latency
+    results["llm_calls"] = fake_llm.calls
+    return results
+
+
+async def run_over_http(args, queries: List[Dict]) -> Dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=None) as client:
+        if args.warmup:
+            await run_load(client, queries, args.endpoint, min(args.concurrency, args.warmup), args.warmup)
+        results = await run_load(client, queries, args.endpoint, args.concurrency, args.requests)
+    results["mode"] = "http"
+    results["url"] = args.url
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help=".jsonl corpus or .http scenario file")
+    parser.add_argument("--endpoint", default="/chat", help="/chat or /chat/stream")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="Unrecorded requests sent first")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Fake LLM seconds per call (in-process)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Fake LLM seconds per streamed token")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache (in-process)")
+    parser.add_argument("--seed", type=int, default=0, help="Shuffle seed for the corpus order")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/...)")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    queries = load_corpus(args.corpus)
+    random.Random(args.seed).shuffle(queries)
+
+    if args.url:
+        results = asyncio.run(run_over_http(args, queries))
+    else:
+        if args.no_cache:
+            os.environ["RESPONSE_CACHE_BACKEND"] = "off"
+        # Every request comes from one client; admission control still applies
+        os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+        results = asyncio.run(run_in_process(args, queries))
+    results["corpus"] = os.path.relpath(args.corpus)
+
+    output = save_results("chat", results, args.output)
+    print_report("chat", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Memory of the packed chunk store against JSON rows and Documents.
+
+Exports every collection of the populated index, repeated --copies times
+to stand in for a larger corpus, twice: as the JSON rows file the numpy
+index used to load into every worker, and as a chunk store. Then, in a
+fresh interpreter per format, loads every collection and answers each
+corpus query the way query_rag reads its hits (top-k by vector, then text,
+source and page). Reports RSS and the part of it private to the process,
+which other workers cannot share, the Python heap held after loading, and
+per-request allocations and latency.
+
+    python populate_database.py   # the index to export
+    python -m benchmarks.bench_chunk_store --copies 50
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.common import DEFAULT_CORPUS, REPO_DIR, latency_summary, load_corpus, print_report, save_results
+
+FORMATS = ("json", "chunk_store")
+
+
+class JsonRowsIndex:
+    """The numpy index as it was before the chunk store: rows from JSON, a Document per hit"""
+
+    def __init__(self, directory: str, name: str):
+        from langchain_core.documents import Document
+
+        self.document_class = Document
+        self.embeddings = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        with open(os.path.join(directory, f"{name}.json"), encoding="utf-8") as f:
+            rows = json.load(f)
+        self.ids = rows["ids"]
+        self.documents = rows["documents"]
+        self.metadatas = rows["metadatas"]
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.squared_norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+
+    def search(self, query_embedding, k: int = 5):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        distances = self.squared_norms - 2.0 * (self.embeddings @ query) + query @ query
+        distances = np.maximum(distances, 0.0)
+        rows = np.argpartition(distances, k)[:k] if k < len(distances) else np.arange(len(distances))
+        rows = rows[np.argsort(distances[rows], kind="stable")]
+        return [
+            (
+                self.document_class(
+                    page_content=self.documents[row], metadata=dict(self.metadatas[row]), id=self.ids[row]
+                ),
+                float(distances[row]),
+            )
+            for row in rows
+        ]
+
+
+def memory_mb() -> Dict[str, float]:
+    """Current RSS and its private part, from /proc where available"""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1] == "kB"}
+        return {
+            "rss_mb": fields["Rss"] / 1024,
+            "private_mb": (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024,
+        }
+    except (OSError, KeyError):
+        return {"rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def answer(index, query_embedding, k: int) -> List:
+    """What query_rag reads of each hit"""
+    return [
+        (doc.page_content, doc.metadata["source"], doc.metadata.get("page"))
+        for doc, _distance in index.search(query_embedding, k=k)
+    ]
+
+
+def run_child(fmt: str, workdir: str, k: int, repeat: int) -> None:
+    """Load one format and answer the queries, printing the measurements as JSON"""
+    with open(os.path.join(workdir, "names.json")) as f:
+        names = json.load(f)
+    queries = np.load(os.path.join(workdir, "queries.npy"))
+    # Import before measuring so only the index counts
+    from vector_index import VectorIndex
+
+    before = memory_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    if fmt == "json":
+        indexes = [JsonRowsIndex(workdir, name) for name in names]
+    else:
+        indexes = [VectorIndex.load(workdir, name) for name in names]
+    load_seconds = time.perf_counter() - start
+    heap_after_load = tracemalloc.get_traced_memory()[0]
+
+    allocated: List[int] = []
+    for index in indexes:
+        for query in queries:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            hits = answer(index, query, k)
+            allocated.append(tracemalloc.get_traced_memory()[1] - current)
+            del hits
+    tracemalloc.stop()
+
+    latencies: List[float] = []
+    for _ in range(repeat):
+        for index in indexes:
+            for query in queries:
+                query_start = time.perf_counter()
+                answer(index, query, k)
+                latencies.append(time.perf_counter() - query_start)
+
+    after = memory_mb()
+    print(json.dumps({
+        "load_s": load_seconds,
+        "heap_after_load_mb": heap_after_load / 2**20,
+        "request_alloc_kb": {
+            "mean": sum(allocated) / len(allocated) / 1024,
+            "max": max(allocated) / 1024,
+        },
+        "request": latency_summary(latencies),
+        "memory_before": before,
+        "memory_after": after,
+        "index_rss_mb": after["rss_mb"] - before["rss_mb"],
+        "index_private_mb": after.get("private_mb", 0.0) - before.get("private_mb", 0.0),
+    }))
+
+
+def export(workdir: str, copies: int, corpus: str) -> Dict:
+    """Write the index in both formats, copies times over, plus the query embeddings"""
+    from chunk_store import write_chunk_store
+    from retrieval_context import COLLECTION_NAMES, get_retrieval_context
+
+    context = get_retrieval_context()
+    sizes = {}
+    for name in COLLECTION_NAMES:
+        data = context.get_db(name).get(include=["embeddings", "documents", "metadatas"])
+        ids = [f"{chunk_id}:{copy}" for copy in range(copies) for chunk_id in data["ids"]]
+        documents = list(data["documents"]) * copies
+        metadatas = [meta or {} for meta in data["metadatas"]] * copies
+        np.save(os.path.join(workdir, f"{name}.npy"), np.tile(np.asarray(data["embeddings"], dtype=np.float32), (copies, 1)))
+        with open(os.path.join(workdir, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents, "metadatas": metadatas}, f)
+        write_chunk_store(workdir, name, ids, documents, metadatas)
+        sizes[name] = {
+            "chunks": len(ids),
+            "json_mb": os.path.getsize(os.path.join(workdir, f"{name}.json")) / 2**20,
+            "chunk_store_mb": sum(
+                os.path.getsize(os.path.join(workdir, f"{name}{suffix}"))
+                for suffix in (".chunks.bin", ".chunks.npy", ".sources.json")
+            ) / 2**20,
+        }
+    with open(os.path.join(workdir, "names.json"), "w") as f:
+        json.dump(list(COLLECTION_NAMES), f)
+    texts = [query["message"] for query in load_corpus(corpus)]
+    np.save(os.path.join(workdir, "queries.npy"),
+            np.asarray(context.embedding_function.embed_documents(texts), dtype=np.float32))
+    return sizes
+
+
+def measure(fmt: str, workdir: str, args) -> Dict:
+    command = [
+        sys.executable, "-m", "benchmarks.bench_chunk_store", "--child", fmt,
+        "--workdir", workdir, "-k", str(args.k), "--repeat", str(args.repeat),
+    ]
+    completed = subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Chunk store benchmark for {fmt} failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--copies", type=int, default=1, help="Times the populated corpus is repeated")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the corpus for latency")
+    parser.add_argument("--child", choices=FORMATS, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.workdir, args.k, args.repeat)
+        return
+
+    results: Dict = {"copies": args.copies, "k": args.k}
+    with tempfile.TemporaryDirectory(prefix="bench-chunk-store-") as workdir:
+        results["files"] = export(workdir, args.copies, args.corpus)
+        for fmt in FORMATS:
+            results[fmt] = measure(fmt, workdir, args)
+
+    json_run, store_run = results["json"], results["chunk_store"]
+    results["reduction"] = {
+        "heap_after_load": 1 - store_run["heap_after_load_mb"] / max(json_run["heap_after_load_mb"], 1e-9),
+        "index_private_mb": json_run["index_private_mb"] - store_run["index_private_mb"],
+        "request_alloc": 1 - store_run["request_alloc_kb"]["mean"] / max(json_run["request_alloc_kb"]["mean"], 1e-9),
+    }
+    output = save_results("chunk_store", results, args.output)
+    print_report("chunk_store", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
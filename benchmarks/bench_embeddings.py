@@ -0,0 +1,118 @@
+"""
+Embedding runtime comparison and parity check.
+
+Runs every EMBEDDING_RUNTIME in a fresh interpreter, so imports count
+towards cold start. Reports cold start (import, model load and first query),
+peak RSS, whether torch was imported and per-query latency. Then compares
+each runtime's corpus vectors with the reference runtime (torch by default)
+by cosine similarity. The run fails if any runtime's minimum cosine falls
+below --min-cosine.
+
+    python -m benchmarks.bench_embeddings --runtimes torch onnx onnx-int8
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.common import DEFAULT_CORPUS, REPO_DIR, latency_summary, load_corpus, print_report, save_results
+
+
+def run_child(runtime: str, corpus: str, repeat: int, vectors_path: str) -> None:
+    """Measure one runtime inside this process and print the results as JSON"""
+    texts = [query["message"] for query in load_corpus(corpus)]
+
+    start = time.perf_counter()
+    from get_embedding_function import get_embedding_function
+    embedding_function = get_embedding_function()
+    embedding_function.embed_query(texts[0])
+    cold_start = time.perf_counter() - start
+
+    latencies: List[float] = []
+    for _ in range(repeat):
+        for text in texts:
+            query_start = time.perf_counter()
+            embedding_function.embed_query(text)
+            latencies.append(time.perf_counter() - query_start)
+
+    np.save(vectors_path, np.asarray(embedding_function.embed_documents(texts), dtype=np.float32))
+    print(json.dumps({
+        "cold_start_s": cold_start,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "torch_imported": "torch" in sys.modules,
+        "embed_query": latency_summary(latencies),
+    }))
+
+
+def measure(runtime: str, args, vectors_path: str) -> Dict:
+    env = dict(os.environ, EMBEDDING_RUNTIME=runtime)
+    command = [
+        sys.executable, "-m", "benchmarks.bench_embeddings", "--child", runtime,
+        "--corpus", args.corpus, "--repeat", str(args.repeat), "--vectors", vectors_path,
+    ]
+    completed = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Embedding runtime {runtime} failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runtimes", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--reference", default="torch", help="Runtime the others are compared with")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the corpus")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--vectors", help=argparse.SUPPRESS)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.corpus, args.repeat, args.vectors)
+        return
+
+    runtimes = list(dict.fromkeys([args.reference] + args.runtimes))
+    results: Dict = {"reference": args.reference}
+    vectors: Dict[str, np.ndarray] = {}
+    with tempfile.TemporaryDirectory(prefix="bench-embeddings-") as workdir:
+        for runtime in runtimes:
+            vectors_path = os.path.join(workdir, f"{runtime}.npy")
+            results[runtime] = measure(runtime, args, vectors_path)
+            vectors[runtime] = np.load(vectors_path)
+
+    failed = []
+    for runtime in runtimes:
+        if runtime == args.reference:
+            continue
+        cosines = cosine_rows(vectors[runtime], vectors[args.reference])
+        results[runtime]["cosine_vs_reference"] = {
+            "mean": float(cosines.mean()),
+            "min": float(cosines.min()),
+        }
+        if cosines.min() < args.min_cosine:
+            failed.append(runtime)
+
+    output = save_results("embeddings", results, args.output)
+    print_report("embeddings", results, output, args.baseline)
+    if failed:
+        raise SystemExit(f"Parity below {args.min_cosine} for: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
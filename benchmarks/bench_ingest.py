@@ -0,0 +1,73 @@
+"""
+Ingestion micro-benchmark for populate_database.main.
+
+Builds the collections from data/ into a scratch directory, so the real
+chroma/ is left alone, and times a cold --reset build followed by a no-op
+incremental rerun.
+
+    python -m benchmarks.bench_ingest --workers 4 --batch-size 64
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import REPO_DIR, print_report, save_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    # populate_database works on relative data/ and chroma/ paths
+    workdir = tempfile.mkdtemp(prefix="bench-ingest-")
+    os.symlink(os.path.join(REPO_DIR, "data"), os.path.join(workdir, "data"))
+    os.chdir(workdir)
+
+    import populate_database
+    from retrieval_context import COLLECTION_NAMES, get_retrieval_context
+
+    argv = ["--no-faq"]
+    if args.workers is not None:
+        argv += ["--workers", str(args.workers)]
+    if args.batch_size is not None:
+        argv += ["--batch-size", str(args.batch_size)]
+
+    try:
+        start = time.perf_counter()
+        populate_database.main(["--reset"] + argv)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        populate_database.main(argv)
+        noop = time.perf_counter() - start
+
+        context = get_retrieval_context()
+        chunks = {name: context.get_collection(name).count() for name in COLLECTION_NAMES}
+        total_chunks = sum(chunks.values())
+        results = {
+            "workers": args.workers or populate_database.DEFAULT_WORKERS,
+            "batch_size": args.batch_size or populate_database.INGEST_BATCH_SIZE,
+            "files": len(populate_database.list_data_files()),
+            "chunks": chunks,
+            "cold_build_s": cold,
+            "cold_chunks_per_s": total_chunks / cold if cold else 0.0,
+            "noop_rerun_s": noop,
+        }
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = save_results("ingest", results, args.output)
+    print_report("ingest", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Retrieval quality of vector, BM25 and hybrid search.
+
+Runs every query of a labelled set (benchmarks/labelled_queries.jsonl, with
+the source:page locations that answer it) against its collection of the
+populated chroma/ directory, through vector search alone, BM25 alone and the
+hybrid search query_rag uses. Reports recall@k (share of queries with a
+relevant chunk in the top k) and MRR per mode, and the latency of BM25
+lookups.
+
+    python populate_database.py   # writes the snapshots and BM25 indexes
+    python -m benchmarks.bench_recall -k 1 3 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Sequence
+
+from benchmarks.common import BENCHMARK_DIR, latency_summary, print_report, save_results
+
+DEFAULT_LABELLED = os.path.join(BENCHMARK_DIR, "labelled_queries.jsonl")
+
+
+def load_labelled(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def first_relevant_rank(hits: Sequence, relevant: Sequence[str]) -> int:
+    """1-based rank of the first hit from a relevant source:page, or 0"""
+    for rank, (doc, _score) in enumerate(hits, start=1):
+        if any(doc.id.startswith(f"{location}:") for location in relevant):
+            return rank
+    return 0
+
+
+def summarize(ranks: List[int], ks: Sequence[int]) -> Dict:
+    summary = {f"recall@{k}": sum(1 for rank in ranks if 0 < rank <= k) / len(ranks) for k in ks}
+    summary["mrr"] = sum(1.0 / rank for rank in ranks if rank) / len(ranks)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--labelled", default=DEFAULT_LABELLED)
+    parser.add_argument("-k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the set for BM25 timings")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    from retrieval import search_collections
+    from retrieval_context import get_retrieval_context
+
+    queries = load_labelled(args.labelled)
+    context = get_retrieval_context()
+    context.initialize()
+    embeddings = context.embedding_function.embed_documents([query["message"] for query in queries])
+    k = max(args.k)
+
+    ranks: Dict[str, List[int]] = {"vector": [], "bm25": [], "hybrid": []}
+    misses: Dict[str, List[str]] = {mode: [] for mode in ranks}
+    for query, embedding in zip(queries, embeddings):
+        names = [query["collection"]]
+        if context.get_lexical_index(query["collection"]) is None:
+            raise SystemExit(f"No BM25 index for {query['collection']}; run populate_database.py first")
+        hits = {
+            "vector": asyncio.run(search_collections(names, embedding, k=k, lexical=False)),
+            "bm25": context.search_lexical(query["collection"], query["message"], embedding, k=k),
+            "hybrid": asyncio.run(search_collections(names, embedding, k=k, query_text=query["message"])),
+        }
+        for mode, mode_hits in hits.items():
+            rank = first_relevant_rank(mode_hits, query["relevant"])
+            ranks[mode].append(rank)
+            if not rank:
+                misses[mode].append(query["message"])
+
+    results: Dict = {"queries": len(queries), "k": args.k}
+    for mode in ranks:
+        results[mode] = summarize(ranks[mode], args.k)
+        results[mode]["misses"] = misses[mode]
+
+    # Posting-list lookup alone, then with documents and distances attached
+    lookups, searches = [], []
+    for _ in range(args.repeat):
+        for query, embedding in zip(queries, embeddings):
+            index = context.get_lexical_index(query["collection"])
+            start = time.perf_counter()
+            index.search(query["message"], k=k)
+            lookups.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            context.search_lexical(query["collection"], query["message"], embedding, k=k)
+            searches.append(time.perf_counter() - start)
+    results["bm25_lookup"] = latency_summary(lookups)
+    results["bm25_search"] = latency_summary(searches)
+
+    output = save_results("recall", results, args.output)
+    print_report("recall", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
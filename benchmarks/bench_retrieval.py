@@ -0,0 +1,69 @@
+"""
+Retrieval-only micro-benchmark.
+
+Times similarity_search_with_score (embedding + vector search) and the
+vector-only search on its own for every corpus query against each
+collection of the populated chroma/ directory. No LLM is involved.
+
+    python -m benchmarks.bench_retrieval --repeat 20
+"""
+import argparse
+import time
+from typing import Dict, List
+
+from benchmarks.common import DEFAULT_CORPUS, latency_summary, load_corpus, print_report, save_results
+
+K = 5
+
+
+def time_calls(fn, inputs: List, repeat: int) -> List[float]:
+    latencies = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=10, help="Passes over the corpus")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    from retrieval_context import COLLECTION_NAMES, get_retrieval_context
+
+    texts = [query["message"] for query in load_corpus(args.corpus)]
+    context = get_retrieval_context()
+
+    start = time.perf_counter()
+    context.initialize()
+    results: Dict = {"initialize_s": time.perf_counter() - start, "k": K, "queries": len(texts)}
+
+    embedding_function = context.embedding_function
+    embeddings = embedding_function.embed_documents(texts)
+    results["embed_query"] = latency_summary(time_calls(embedding_function.embed_query, texts, args.repeat))
+
+    for name in COLLECTION_NAMES:
+        db = context.get_db(name)
+        results[name] = {
+            "similarity_search_with_score": latency_summary(
+                time_calls(lambda text: db.similarity_search_with_score(text, k=K), texts, args.repeat)
+            ),
+            "search_by_vector": latency_summary(
+                time_calls(
+                    lambda vector: db.similarity_search_by_vector_with_relevance_scores(vector, k=K),
+                    embeddings, args.repeat
+                )
+            ),
+        }
+
+    output = save_results("retrieval", results, args.output)
+    print_report("retrieval", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
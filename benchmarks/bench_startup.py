@@ -0,0 +1,114 @@
+"""
+Cold-start benchmark for the chat server.
+
+Starts the fake LLM server and a fresh uvicorn process for app.main, then
+polls until the server first answers /health (listening) and until /chat
+first succeeds, both measured from process launch. The warmup's own import
+and init breakdown is collected through STARTUP_PROFILE and included in the
+results.
+
+    python -m benchmarks.bench_startup --runs 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.common import REPO_DIR, latency_summary, print_report, save_results
+
+
+def wait_for(url: str, method: str, start: float, deadline: float, **kwargs) -> Optional[float]:
+    """Poll until the URL answers 200; seconds since start, or None on timeout"""
+    while time.perf_counter() < deadline:
+        try:
+            response = httpx.request(method, url, timeout=5, **kwargs)
+            if response.status_code == 200:
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable] + args, cwd=REPO_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def measure_once(port: int, llm_port: int, timeout: float) -> Dict:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        profile_path = f.name
+    env = dict(
+        os.environ,
+        LLAMA_API_URL=f"http://127.0.0.1:{llm_port}",
+        RESPONSE_CACHE_BACKEND="off",
+        STARTUP_PROFILE=profile_path,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = start_process(
+        ["-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"], env
+    )
+    try:
+        deadline = start + timeout
+        listening = wait_for(f"{base_url}/health", "GET", start, deadline)
+        first_chat = wait_for(
+            f"{base_url}/chat", "POST", start, deadline, json={"message": "How do you play chess?"}
+        )
+        health = httpx.get(f"{base_url}/health", timeout=5).json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    with open(profile_path) as f:
+        profile = json.load(f)
+    os.unlink(profile_path)
+    if first_chat is None:
+        raise SystemExit(f"No successful chat within {timeout}s; /health said {health}")
+    return {
+        "listening_s": listening,
+        "first_chat_s": first_chat,
+        "startup": health.get("startup"),
+        "profile": profile,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    llm = start_process(
+        ["-m", "benchmarks.fake_llm_server", "--port", str(args.llm_port)], dict(os.environ)
+    )
+    try:
+        runs = [measure_once(args.port, args.llm_port, args.timeout) for _ in range(args.runs)]
+    finally:
+        llm.terminate()
+        llm.wait()
+
+    results = {
+        "runs": args.runs,
+        "listening": latency_summary([run["listening_s"] for run in runs]),
+        "first_chat": latency_summary([run["first_chat_s"] for run in runs]),
+        "last_profile": runs[-1]["profile"],
+    }
+    output = save_results("startup", results, args.output)
+    print_report("startup", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Numpy vector index versus Chroma.
+
+For every collection of the populated chroma/ directory, runs each corpus
+query through Chroma's vector search and through the memory-mapped numpy
+snapshot, one query at a time and as a single batch. Reports latency and the
+recall@k of Chroma's approximate HNSW results against the exact numpy top-k.
+
+    python populate_database.py   # writes the snapshots
+    python -m benchmarks.bench_vector_index --repeat 20
+"""
+import argparse
+import time
+from typing import Dict, List
+
+from benchmarks.bench_retrieval import K, time_calls
+from benchmarks.common import DEFAULT_CORPUS, latency_summary, load_corpus, print_report, save_results
+
+
+def recall(expected: List, found: List) -> float:
+    """Fraction of the expected (Document, score) hits that were found"""
+    expected_ids = {doc.id for doc, _score in expected}
+    if not expected_ids:
+        return 1.0
+    return len(expected_ids & {doc.id for doc, _score in found}) / len(expected_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=10, help="Passes over the corpus")
+    parser.add_argument("-k", type=int, default=K)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    from retrieval_context import COLLECTION_NAMES, get_retrieval_context
+
+    texts = [query["message"] for query in load_corpus(args.corpus)]
+    context = get_retrieval_context()
+    embeddings = context.embedding_function.embed_documents(texts)
+    results: Dict = {"k": args.k, "queries": len(texts)}
+
+    for name in COLLECTION_NAMES:
+        db = context.get_db(name)
+        start = time.perf_counter()
+        index = context.get_vector_index(name)
+        load_time = time.perf_counter() - start
+        if index is None:
+            raise SystemExit(f"No vector index for {name}; run populate_database.py first")
+
+        exact = index.search_batch(embeddings, k=args.k)
+        approximate = [
+            db.similarity_search_by_vector_with_relevance_scores(vector, k=args.k)
+            for vector in embeddings
+        ]
+        recalls = [recall(e, a) for e, a in zip(exact, approximate)]
+        max_score_error = max(
+            (abs(e_score - a_score)
+             for e_hits, a_hits in zip(exact, approximate)
+             for (_e, e_score), (_a, a_score) in zip(e_hits, a_hits)),
+            default=0.0,
+        )
+
+        batch_latencies = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            index.search_batch(embeddings, k=args.k)
+            batch_latencies.append((time.perf_counter() - start) / len(embeddings))
+
+        results[name] = {
+            "vectors": len(index),
+            "load_s": load_time,
+            "chroma_recall_at_k": sum(recalls) / len(recalls) if recalls else 1.0,
+            "max_score_difference": max_score_error,
+            "chroma": latency_summary(time_calls(
+                lambda vector: db.similarity_search_by_vector_with_relevance_scores(vector, k=args.k),
+                embeddings, args.repeat
+            )),
+            "numpy": latency_summary(time_calls(
+                lambda vector: index.search(vector, k=args.k), embeddings, args.repeat
+            )),
+            "numpy_batch_per_query": latency_summary(batch_latencies),
+        }
+
+    output = save_results("vector_index", results, args.output)
+    print_report("vector_index", results, output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
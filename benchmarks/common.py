@@ -0,0 +1,125 @@
+"""Shared helpers for the benchmark scripts: corpora, percentiles and result files."""
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, "queries.jsonl")
+
+
+def load_corpus(path: str = DEFAULT_CORPUS) -> List[Dict]:
+    """Load queries from a .jsonl file ({"message": ..., "kind": ...}) or a .http file"""
+    if path.endswith(".http"):
+        return load_http_scenarios(path)
+
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            message = entry.get("message") or entry.get("query")
+            if message:
+                queries.append({"message": message, "kind": entry.get("kind", "unknown")})
+    return queries
+
+
+def load_http_scenarios(path: str) -> List[Dict]:
+    """Pull the chat messages out of the JSON bodies in a .http file such as test.http"""
+    with open(path) as f:
+        content = f.read()
+    messages = re.findall(r'^\s*"message":\s*"(.*)"\s*$', content, flags=re.MULTILINE)
+    return [{"message": message, "kind": "http"} for message in dict.fromkeys(messages)]
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """Linear-interpolated percentile of an unsorted sequence"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def latency_summary(latencies: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of latencies in seconds, reported in milliseconds"""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def save_results(name: str, results: Dict, output: Optional[str] = None) -> str:
+    """Write results plus run metadata to JSON and return the file path"""
+    revision = git_revision()
+    payload = {
+        "benchmark": name,
+        "revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"{name}-{revision or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=2)
+    return output
+
+
+def compare_results(baseline_path: str, results: Dict) -> List[str]:
+    """Describe how every numeric result moved relative to a saved baseline"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    lines = []
+
+    def walk(old, new, prefix):
+        if isinstance(new, dict) and isinstance(old, dict):
+            for key, value in new.items():
+                if key in old:
+                    walk(old[key], value, f"{prefix}.{key}" if prefix else key)
+        elif isinstance(new, (int, float)) and isinstance(old, (int, float)) and old:
+            change = (new - old) / old * 100
+            lines.append(f"{prefix}: {old:.3f} -> {new:.3f} ({change:+.1f}%)")
+
+    walk(baseline, results, "")
+    return lines
+
+
+def print_report(name: str, results: Dict, output_path: str, baseline: Optional[str] = None) -> None:
+    print(json.dumps(results, indent=2))
+    print(f"\n{name} results saved to {output_path}")
+    if baseline:
+        print(f"\nCompared with {baseline}:")
+        for line in compare_results(baseline, results):
+            print(f"  {line}")
@@ -0,0 +1,110 @@
+"""
+Local stand-ins for the LlamaAPI chat completions endpoint.
+
+The server speaks OpenAI-compatible /chat/completions, streamed or not, with a
+configurable delay so the chatbot can be exercised without the real API:
+
+    python -m benchmarks.fake_llm_server --port 8089 --latency 0.5
+    LLAMA_API_URL=http://localhost:8089 gunicorn app.main:app ...
+
+FakeLLMClient gives the same answers in-process, without HTTP, for benchmarks
+that should only measure the chatbot's own overhead.
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from llm_client import LLMClient
+
+CANNED_ANSWER = (
+    "This is a canned answer from the fake LLM server. "
+    "It stands in for the real model during local testing and benchmarks."
+)
+
+app = FastAPI(title="Fake LLM API")
+app.state.latency = 0.0
+app.state.token_delay = 0.0
+app.state.answer = CANNED_ANSWER
+
+
+class FakeLLMClient(LLMClient):
+    """In-process LLM client that answers with canned text after a fixed delay"""
+
+    def __init__(self, latency: float = 0.0, token_delay: float = 0.0, answer: str = CANNED_ANSWER):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.answer = answer
+        self.calls = 0
+
+    async def complete(self, request_json: Dict, timeout: Optional[float] = None) -> Dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer}}]}
+
+    async def stream(self, request_json: Dict, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        for word in self.answer.split(" "):
+            yield word + " "
+            await asyncio.sleep(self.token_delay)
+
+
+def _completion_chunk(content: str, finish_reason=None) -> str:
+    chunk = {
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    """Answer every request with the canned text after the configured delay"""
+    body = await request.json()
+    await asyncio.sleep(app.state.latency)
+
+    if body.get("stream"):
+        async def stream():
+            for word in app.state.answer.split(" "):
+                yield _completion_chunk(word + " ")
+                await asyncio.sleep(app.state.token_delay)
+            yield _completion_chunk("", finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return JSONResponse({
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": app.state.answer},
+            "finish_reason": "stop",
+        }],
+    })
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    args = parser.parse_args()
+
+    app.state.latency = args.latency
+    app.state.token_delay = args.token_delay
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import json
+import logging
+import mmap
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Byte offsets into the blob, where each chunk's ID is followed by its text
+ROW_DTYPE = np.dtype([
+    ("id_start", "<i8"),
+    ("text_start", "<i8"),
+    ("text_end", "<i8"),
+    ("source", "<i4"),
+    ("page", "<i4"),
+])
+NO_PAGE = -1
+
+
+def chunk_store_paths(directory: str, collection_name: str) -> Tuple[str, str, str]:
+    """Text blob, row table and interned source files of a chunk store"""
+    base = os.path.join(directory, collection_name)
+    return f"{base}.chunks.bin", f"{base}.chunks.npy", f"{base}.sources.json"
+
+
+def write_chunk_store(directory: str, collection_name: str, ids: Sequence[str],
+                      documents: Sequence[str], metadatas: Sequence[Dict]) -> None:
+    """Pack chunk IDs, texts, sources and pages; the row table is replaced last"""
+    sources: Dict[str, int] = {}
+    rows = np.zeros(len(ids), dtype=ROW_DTYPE)
+    blob_path, rows_path, sources_path = chunk_store_paths(directory, collection_name)
+    os.makedirs(directory, exist_ok=True)
+
+    with open(f"{blob_path}.tmp", "wb") as f:
+        offset = 0
+        for row, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            id_bytes = chunk_id.encode("utf-8")
+            text_bytes = (document or "").encode("utf-8")
+            f.write(id_bytes)
+            f.write(text_bytes)
+            page = metadata.get("page")
+            rows[row] = (
+                offset,
+                offset + len(id_bytes),
+                offset + len(id_bytes) + len(text_bytes),
+                sources.setdefault(metadata.get("source", ""), len(sources)),
+                NO_PAGE if page is None else int(page),
+            )
+            offset += len(id_bytes) + len(text_bytes)
+    with open(f"{sources_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(list(sources), f)
+    with open(f"{rows_path}.tmp", "wb") as f:
+        np.save(f, rows)
+
+    # A reader between these replacements sees a blob and table that
+    # disagree in size, which ChunkStore rejects
+    os.replace(f"{blob_path}.tmp", blob_path)
+    os.replace(f"{sources_path}.tmp", sources_path)
+    os.replace(f"{rows_path}.tmp", rows_path)
+    logger.info(f"Wrote chunk store of {collection_name}: {len(rows)} chunks, {offset} bytes, {len(sources)} sources")
+
+
+class ChunkStore:
+    """
+    Packed text and metadata of one collection snapshot
+
+    Chunk IDs and texts are stored back to back in one UTF-8 blob, and a
+    fixed-width row table holds each chunk's byte offsets, page and an index
+    into the list of distinct sources. The blob and table are
+    memory-mapped, so workers share one page-cache copy and a chunk's text
+    only becomes a Python string when a hit reads it.
+    """
+
+    def __init__(self, name: str, blob, rows: np.ndarray, sources: List[str]):
+        if len(rows) and int(rows["text_end"][-1]) != len(blob):
+            raise ValueError(f"Chunk store of {name} has {len(blob)} bytes, rows end at {rows['text_end'][-1]}")
+        self.name = name
+        self.blob = blob
+        self.rows = rows
+        self.sources = sources
+        # Column views into the mapped table
+        self._id_start = rows["id_start"]
+        self._text_start = rows["text_start"]
+        self._text_end = rows["text_end"]
+        self._source = rows["source"]
+        self._page = rows["page"]
+
+    @classmethod
+    def load(cls, directory: str, collection_name: str) -> "ChunkStore":
+        blob_path, rows_path, sources_path = chunk_store_paths(directory, collection_name)
+        rows = np.load(rows_path, mmap_mode="r")
+        with open(sources_path, encoding="utf-8") as f:
+            sources = json.load(f)
+        with open(blob_path, "rb") as f:
+            # An empty file cannot be mapped
+            size = os.fstat(f.fileno()).st_size
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        return cls(collection_name, blob, rows, sources)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def chunk_id(self, row: int) -> str:
+        return self.blob[int(self._id_start[row]):int(self._text_start[row])].decode("utf-8")
+
+    def text(self, row: int) -> str:
+        return self.blob[int(self._text_start[row]):int(self._text_end[row])].decode("utf-8")
+
+    def source(self, row: int) -> str:
+        return self.sources[int(self._source[row])]
+
+    def page(self, row: int) -> Optional[int]:
+        page = int(self._page[row])
+        return None if page == NO_PAGE else page
+
+    def ids(self) -> List[str]:
+        return [self.chunk_id(row) for row in range(len(self))]
+
+    def texts(self) -> List[str]:
+        return [self.text(row) for row in range(len(self))]
+
+    def metadata(self, row: int) -> Dict:
+        """id and source, plus page if the chunk has one, as Chroma stores it"""
+        metadata = {"id": self.chunk_id(row), "source": self.source(row)}
+        page = self.page(row)
+        if page is not None:
+            metadata["page"] = page
+        return metadata
+
+
+class ChunkRecord:
+    """
+    One retrieved chunk, read from its store on access
+
+    Provides what retrieval and prompt building use of a langchain Document:
+    page_content, id and a metadata dict (id, source and page, plus keys the
+    retrieval adds), without copying the text or metadata per hit.
+    """
+
+    __slots__ = ("store", "row", "_metadata")
+
+    def __init__(self, store: ChunkStore, row: int):
+        self.store = store
+        self.row = row
+        self._metadata: Optional[Dict] = None
+
+    @property
+    def page_content(self) -> str:
+        return self.store.text(self.row)
+
+    @property
+    def id(self) -> str:
+        return self.store.chunk_id(self.row)
+
+    @property
+    def metadata(self) -> Dict:
+        if self._metadata is None:
+            self._metadata = self.store.metadata(self.row)
+        return self._metadata
+
+    def __repr__(self) -> str:
+        return f"ChunkRecord({self.store.name}, row={self.row}, id={self.id!r})"
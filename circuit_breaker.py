@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from llm_client import LLMError, LLMOverloadedError
+from metrics import counter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))  # most recent calls considered
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", "15"))
+LLM_BREAKER_SLOW_RATE = float(os.getenv("LLM_BREAKER_SLOW_RATE", "0.8"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+LLM_BREAKER_HALF_OPEN_PROBES = int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "1"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "25"))
+
+BREAKER_TRANSITIONS = counter(
+    "circuit_breaker_transitions_total",
+    "Circuit breaker state changes by breaker and new state",
+)
+BREAKER_REJECTED = counter(
+    "circuit_breaker_rejected_total",
+    "Calls refused without trying because the breaker was open",
+)
+
+
+class CircuitOpenError(LLMError):
+    """The breaker is open; the call was not attempted"""
+
+
+class DeadlineExceeded(LLMError):
+    """Too little of the request's time budget is left to call the LLM"""
+
+
+class Deadline:
+    """Time budget of one request, shared by retrieval and generation"""
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """Seconds a step may take: what is left, at most cap"""
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
+
+
+class CircuitBreaker:
+    """
+    Failure-rate and latency circuit breaker around an upstream call
+
+    Closed, it passes calls through and keeps the outcome of the most recent
+    `window` calls. Once at least min_calls are recorded and either the share
+    of failures reaches failure_rate or the share of calls slower than
+    slow_seconds reaches slow_rate, it opens and refuses calls outright.
+    After open_seconds it turns half-open and lets half_open_probes calls
+    through; one success closes it, one failure opens it again.
+    """
+
+    def __init__(self, name: str, window: int = LLM_BREAKER_WINDOW,
+                 min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 failure_rate: float = LLM_BREAKER_FAILURE_RATE,
+                 slow_seconds: float = LLM_BREAKER_SLOW_SECONDS,
+                 slow_rate: float = LLM_BREAKER_SLOW_RATE,
+                 open_seconds: float = LLM_BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = LLM_BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = "closed"
+        self.opened_at: Optional[float] = None
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)  # (failed, slow)
+        self._probes = 0
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=state)
+        self.state = state
+        if state == "open":
+            self.opened_at = time.monotonic()
+        elif state == "closed":
+            self.opened_at = None
+            self._outcomes.clear()
+        self._probes = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; a granted half-open probe must be recorded"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                BREAKER_REJECTED.inc(breaker=self.name)
+                return False
+            self._transition("half_open")
+        if self.state == "half_open":
+            if self._probes >= self.half_open_probes:
+                BREAKER_REJECTED.inc(breaker=self.name)
+                return False
+            self._probes += 1
+        return True
+
+    def record(self, duration: float, failed: bool) -> None:
+        """Record the outcome of an allowed call"""
+        slow = duration >= self.slow_seconds
+        if self.state == "half_open":
+            self._probes = max(0, self._probes - 1)
+            self._transition("open" if failed or slow else "closed")
+            return
+        self._outcomes.append((failed, slow))
+        calls = len(self._outcomes)
+        if self.state == "closed" and calls >= self.min_calls:
+            failures = sum(1 for outcome in self._outcomes if outcome[0])
+            slow_calls = sum(1 for outcome in self._outcomes if outcome[1])
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_rate:
+                logger.warning(
+                    f"Circuit breaker {self.name} tripped: {failures}/{calls} failed, {slow_calls}/{calls} slow"
+                )
+                self._transition("open")
+
+    def abandon(self) -> None:
+        """Give back a half-open probe whose call was cancelled before finishing"""
+        if self.state == "half_open":
+            self._probes = max(0, self._probes - 1)
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn() through the breaker; raises CircuitOpenError while open"""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit breaker {self.name} is {self.state}")
+        start = time.perf_counter()
+        try:
+            result = await fn()
+        except LLMOverloadedError:
+            # Our own backpressure, not an upstream failure
+            self.abandon()
+            raise
+        except asyncio.CancelledError:
+            self.abandon()
+            raise
+        except Exception:
+            self.record(time.perf_counter() - start, failed=True)
+            raise
+        self.record(time.perf_counter() - start, failed=False)
+        return result
+
+    def stats(self) -> Dict:
+        calls = len(self._outcomes)
+        stats = {
+            "state": self.state,
+            "calls": calls,
+            "failure_rate": round(sum(1 for o in self._outcomes if o[0]) / calls, 3) if calls else 0.0,
+            "slow_rate": round(sum(1 for o in self._outcomes if o[1]) / calls, 3) if calls else 0.0,
+        }
+        if self.state == "open":
+            stats["retry_in_s"] = round(max(0.0, self.opened_at + self.open_seconds - time.monotonic()), 1)
+        return stats
+
+
+_llm_breaker: Optional[CircuitBreaker] = None
+
+
+def get_llm_breaker() -> CircuitBreaker:
+    """Return the process-wide breaker around LLM calls"""
+    global _llm_breaker
+    if _llm_breaker is None:
+        _llm_breaker = CircuitBreaker("llm")
+    return _llm_breaker
@@ -0,0 +1,234 @@
+import logging
+import math
+import os
+import re
+import traceback
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from chunk_store import ChunkRecord
+
+from lexical_index import tokenize
+from retrieval_context import RetrievalContext, get_retrieval_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "5"))
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "10"))  # candidates retrieved for MMR
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.95"))
+CHUNK_SEPARATOR = "\n\n---\n\n"
+MAX_OVERLAP_CHARS = 200  # populate_database splits with an 80-character overlap
+MIN_OVERLAP_CHARS = 20  # shorter matches are coincidences, not the splitter's overlap
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "3"))
+EXTRACTIVE_MAX_SENTENCE_CHARS = 400
+EXTRACTIVE_INTRO = "I can't write a full answer right now, but this is what the guide says:"
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+LINE_BREAK_HYPHEN = re.compile(r"(\w)- (\w)")  # "play- ers" from PDF line breaks
+
+Hit = Tuple[Union[Document, ChunkRecord], float]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count: about four characters per token for English"""
+    return math.ceil(len(text) / 4)
+
+
+def chunk_position(doc: Document) -> Tuple[str, int]:
+    """(source:page, chunk index) parsed from the chunk ID, or (ID, -1)"""
+    chunk_id = doc.id or doc.metadata.get("id") or ""
+    parts = chunk_id.rsplit(":", 2)
+    if len(parts) == 3 and parts[1].isdigit():
+        return parts[0], int(parts[1])
+    return chunk_id, -1
+
+
+def merge_overlap(first: str, second: str) -> str:
+    """Join two adjacent chunks, writing their shared overlap only once"""
+    for size in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+class ContextSelection:
+    """Passages chosen for the prompt and the hits they came from"""
+
+    def __init__(self, passages: List[str], hits: List[Hit], tokens_before: int):
+        self.passages = passages
+        self.hits = hits
+        self.tokens_before = tokens_before
+
+    @property
+    def text(self) -> str:
+        return CHUNK_SEPARATOR.join(self.passages)
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+def _unit_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def hit_embeddings(hits: Sequence[Hit], context: Optional[RetrievalContext] = None) -> Optional[np.ndarray]:
+    """Stored embeddings of the hits, fetched per collection from the context they came from"""
+    context = context or get_retrieval_context()
+    by_collection: Dict[str, List[int]] = defaultdict(list)
+    for position, (doc, _score) in enumerate(hits):
+        by_collection[doc.metadata.get("collection")].append(position)
+    if None in by_collection:
+        return None
+
+    rows: List[Optional[np.ndarray]] = [None] * len(hits)
+    try:
+        with context.lease():
+            for collection_name, positions in by_collection.items():
+                ids = [hits[p][0].id or hits[p][0].metadata["id"] for p in positions]
+                for position, vector in zip(positions, context.get_embeddings(collection_name, ids)):
+                    rows[position] = vector
+    except Exception as e:
+        logger.warning(f"Could not fetch chunk embeddings, skipping MMR: {e}")
+        logger.debug(traceback.format_exc())
+        return None
+    return np.vstack(rows)
+
+
+def select_mmr(query_embedding: Sequence[float], hits: List[Hit], embeddings: np.ndarray,
+               budget: int, max_chunks: int, mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+               duplicate_similarity: float = CONTEXT_DUPLICATE_SIMILARITY) -> List[int]:
+    """
+    Pick hits by max marginal relevance within the token budget
+
+    Each step takes the candidate with the best trade-off between similarity
+    to the query and dissimilarity to what is already chosen. Candidates
+    nearly identical to a chosen chunk are dropped outright.
+    """
+    vectors = _unit_rows(np.asarray(embeddings, dtype=np.float32))
+    query = _unit_rows(np.asarray(query_embedding, dtype=np.float32))
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    selected: List[int] = []
+    remaining = list(range(len(hits)))
+    used = 0
+    while remaining and len(selected) < max_chunks:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(scores))
+        candidate = remaining.pop(best)
+        if redundancy[best] >= duplicate_similarity:
+            continue
+        tokens = estimate_tokens(hits[candidate][0].page_content)
+        if selected and used + tokens > budget:
+            continue
+        selected.append(candidate)
+        used += tokens
+    return selected
+
+
+def merge_passages(hits: List[Hit]) -> List[str]:
+    """Merge adjacent chunks of the same page into one passage; first-chosen order"""
+    groups: Dict[str, List[Tuple[int, int, str]]] = defaultdict(list)
+    order: List[str] = []
+    for rank, (doc, _score) in enumerate(hits):
+        page_key, index = chunk_position(doc)
+        if page_key not in groups:
+            order.append(page_key)
+        groups[page_key].append((index, rank, doc.page_content))
+
+    passages: List[Tuple[int, str]] = []
+    for page_key in order:
+        members = sorted(groups[page_key])
+        run_rank, run_index, run_text = members[0][1], members[0][0], members[0][2]
+        for index, rank, text in members[1:]:
+            if run_index >= 0 and index == run_index + 1:
+                run_text = merge_overlap(run_text, text)
+                run_rank = min(run_rank, rank)
+            elif text == run_text:
+                continue
+            else:
+                passages.append((run_rank, run_text))
+                run_rank, run_text = rank, text
+            run_index = index
+        passages.append((run_rank, run_text))
+    return [text for _rank, text in sorted(passages, key=lambda passage: passage[0])]
+
+
+def build_context(query_embedding: Sequence[float], hits: List[Hit],
+                  budget: int = CONTEXT_TOKEN_BUDGET,
+                  max_chunks: int = CONTEXT_MAX_CHUNKS,
+                  context: Optional[RetrievalContext] = None) -> ContextSelection:
+    """
+    Choose, deduplicate and merge retrieved chunks into the prompt context
+
+    Pass the context the hits were retrieved from, so MMR looks their
+    embeddings up in the same index version even after a swap.
+    """
+    baseline = CHUNK_SEPARATOR.join(doc.page_content for doc, _score in hits[:max_chunks])
+    tokens_before = estimate_tokens(baseline)
+
+    embeddings = hit_embeddings(hits, context) if hits else None
+    if embeddings is not None:
+        chosen = select_mmr(query_embedding, hits, embeddings, budget, max_chunks)
+    else:
+        chosen, used = [], 0
+        for position, (doc, _score) in enumerate(hits[:max_chunks]):
+            tokens = estimate_tokens(doc.page_content)
+            if chosen and used + tokens > budget:
+                break
+            chosen.append(position)
+            used += tokens
+
+    selected = [hits[position] for position in chosen]
+    selection = ContextSelection(merge_passages(selected), selected, tokens_before)
+    logger.info(
+        f"Context tokens: {selection.tokens_before} -> {selection.tokens} "
+        f"({len(selected)} of {len(hits)} chunks, {len(selection.passages)} passages)"
+    )
+    return selection
+
+
+def extractive_answer(query_text: str, passages: List[str],
+                      max_sentences: int = EXTRACTIVE_MAX_SENTENCES) -> Optional[str]:
+    """
+    Answer by quoting the retrieved passages, without the LLM
+
+    Takes the sentences sharing the most terms with the query, earlier
+    passages first on ties, and quotes them in document order. Falls back to
+    the opening of the best passage; None if there are no passages.
+    """
+    query_terms = set(tokenize(query_text))
+    candidates: List[Tuple[int, int, int, str]] = []
+    sentences: List[List[str]] = []
+    for position, passage in enumerate(passages):
+        text = LINE_BREAK_HYPHEN.sub(r"\1\2", " ".join(passage.split()))
+        passage_sentences = [
+            sentence[:EXTRACTIVE_MAX_SENTENCE_CHARS] for sentence in SENTENCE_END.split(text)
+            if len(sentence) >= 20
+        ]
+        sentences.append(passage_sentences)
+        for index, sentence in enumerate(passage_sentences):
+            overlap = len(query_terms & set(tokenize(sentence)))
+            if overlap:
+                candidates.append((-overlap, position, index, sentence))
+
+    if candidates:
+        chosen = sorted(sorted(candidates)[:max_sentences], key=lambda c: (c[1], c[2]))
+        quotes = [sentence for _overlap, _position, _index, sentence in chosen]
+    else:
+        quotes = next((passage[:max_sentences] for passage in sentences if passage), [])
+    if not quotes:
+        return None
+    return EXTRACTIVE_INTRO + "\n\n" + "\n".join(f'- "{quote}"' for quote in quotes)
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from metrics import histogram
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "10"))
+
+BATCH_SIZE_HISTOGRAM = histogram(
+    "embedding_batch_size",
+    "Number of queries embedded per micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+QUEUE_WAIT_HISTOGRAM = histogram(
+    "embedding_queue_wait_seconds",
+    "Time a query waited in the micro-batch queue before embedding",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class EmbeddingBatcher:
+    """Collect concurrent query embeddings into single embed_documents calls"""
+
+    def __init__(self, embedding_function, max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.embedding_function = embedding_function
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def embed_query(self, text: str) -> List[float]:
+        """Queue a query and wait for its vector from the next batch"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """Hand the queued queries to a background embedding task"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        started = time.perf_counter()
+        for _text, _future, enqueued in batch:
+            QUEUE_WAIT_HISTOGRAM.observe(started - enqueued)
+
+        # Identical queries in one window share a single row
+        texts = list(dict.fromkeys(text for text, _future, _enqueued in batch))
+        BATCH_SIZE_HISTOGRAM.observe(len(texts))
+
+        try:
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(
+                None,
+                lambda: self.embedding_function.embed_documents(texts)
+            )
+        except Exception as e:
+            logger.error(f"Error embedding batch of {len(texts)} queries: {e}")
+            for _text, future, _enqueued in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(texts, vectors))
+        for text, future, _enqueued in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+        logger.debug(
+            f"Embedded batch of {len(texts)} queries in "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Return the process-wide batcher in front of the shared embedding model"""
+    global _batcher
+    if _batcher is None:
+        from retrieval_context import get_retrieval_context
+        _batcher = EmbeddingBatcher(get_retrieval_context().embedding_function)
+    return _batcher
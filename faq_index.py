@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import counter
+from query_router import get_query_router
+from response_cache import normalize_query
+from retrieval_context import get_retrieval_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FAQ_ANSWERS = os.getenv("FAQ_ANSWERS", "on")  # on or off
+FAQ_QUESTIONS_PATH = os.getenv("FAQ_QUESTIONS_PATH", "faq_questions.json")
+FAQ_SIMILARITY = float(os.getenv("FAQ_SIMILARITY", "0.9"))
+
+FAQ_LOOKUPS = counter(
+    "faq_answers_total",
+    "Queries answered from the precomputed FAQ index, by match type",
+)
+
+
+def faq_index_dir() -> str:
+    """FAQ index of the index version this process serves"""
+    return os.path.join(get_retrieval_context().chroma_path, "faq_index")
+
+
+def faq_paths(directory: Optional[str] = None) -> Tuple[str, str]:
+    """Question embedding matrix and entry files of the FAQ index"""
+    directory = directory or faq_index_dir()
+    return os.path.join(directory, "faq.npy"), os.path.join(directory, "faq.json")
+
+
+def load_faq_questions(path: str = FAQ_QUESTIONS_PATH) -> List[str]:
+    """Read the configured FAQ questions"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [question.strip() for question in json.load(f) if question.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def documents_fingerprint(manifest: Dict) -> str:
+    """Hash of every ingested file's content; changes whenever the documents do"""
+    digest = hashlib.sha256()
+    for path, entry in sorted(manifest.get("files", {}).items()):
+        digest.update(f"{path}:{entry.get('sha256')}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FAQIndex:
+    """Precomputed answers to the FAQ questions, looked up by text or embedding"""
+
+    def __init__(self, entries: List[Dict], embeddings: np.ndarray, fingerprint: str):
+        if len(entries) != embeddings.shape[0]:
+            raise ValueError(f"FAQ index has {embeddings.shape[0]} vectors but {len(entries)} entries")
+        self.entries = entries
+        self.embeddings = embeddings
+        self.fingerprint = fingerprint
+        self._by_text = {normalize_query(entry["question"]): entry for entry in entries}
+        # Games named by each question; a paraphrase must name the same ones
+        router = get_query_router()
+        self._games = [frozenset(router.matches(entry["question"]).get("game", ())) for entry in entries]
+
+    @classmethod
+    def load(cls, directory: Optional[str] = None) -> "FAQIndex":
+        matrix_path, entries_path = faq_paths(directory)
+        with open(entries_path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["entries"], np.load(matrix_path), data["fingerprint"])
+
+    def save(self, directory: Optional[str] = None) -> None:
+        """Write the entries, then the matrix that readers reload on"""
+        directory = directory or faq_index_dir()
+        os.makedirs(directory, exist_ok=True)
+        matrix_path, entries_path = faq_paths(directory)
+        with open(f"{entries_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "entries": self.entries}, f, indent=2)
+        os.replace(f"{entries_path}.tmp", entries_path)
+        with open(f"{matrix_path}.tmp", "wb") as f:
+            np.save(f, self.embeddings)
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup_exact(self, query: str) -> Optional[Dict]:
+        """Entry whose question matches the query after normalization"""
+        entry = self._by_text.get(normalize_query(query))
+        if entry is not None:
+            FAQ_LOOKUPS.inc(match="exact")
+        return entry
+
+    def lookup_similar(self, query_embedding, games: Tuple[str, ...] = (),
+                       threshold: float = FAQ_SIMILARITY) -> Optional[Dict]:
+        """
+        Entry whose question embedding is at least threshold cosine-similar
+
+        Only questions naming the same games as the query qualify, since
+        "How do you play chess?" and "How do you play Reversi?" embed close
+        together.
+        """
+        if not len(self.entries):
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        similarities = self.embeddings @ (query / norm)
+        games = frozenset(games)
+        similarities = np.where([entry_games == games for entry_games in self._games], similarities, -1.0)
+        best = int(np.argmax(similarities))
+        if similarities[best] < threshold:
+            return None
+        FAQ_LOOKUPS.inc(match="similar")
+        logger.info(f"FAQ match {similarities[best]:.3f}: {self.entries[best]['question']}")
+        return self.entries[best]
+
+
+_index: Optional[Tuple[str, float, FAQIndex]] = None
+_index_lock = threading.Lock()
+
+
+def get_faq_index() -> Optional[FAQIndex]:
+    """Return the FAQ index, reloading it after populate rewrites it or the index version changes"""
+    global _index
+    if FAQ_ANSWERS == "off":
+        return None
+    directory = faq_index_dir()
+    matrix_path, _entries_path = faq_paths(directory)
+    try:
+        mtime = os.stat(matrix_path).st_mtime
+    except FileNotFoundError:
+        return None
+    if _index is not None and _index[:2] == (directory, mtime):
+        return _index[2]
+    with _index_lock:
+        if _index is None or _index[:2] != (directory, mtime):
+            try:
+                _index = (directory, mtime, FAQIndex.load(directory))
+                logger.info(f"Loaded FAQ index from {directory}: {len(_index[2])} answers")
+            except Exception as e:
+                logger.warning(f"Could not load FAQ index: {e}")
+                return _index[2] if _index is not None else None
+    return _index[2]
+
+
+async def generate_answers(questions: List[str]) -> List[Dict]:
+    """Answer questions through the normal retrieval and LLM path"""
+    # query_data looks answers up in this module, so import it lazily
+    from llm_client import close_llm_client
+    from query_data import call_llama_api, prepare_query
+
+    entries = []
+    try:
+        for question in questions:
+            try:
+                prepared = await prepare_query(question, faq=False)
+                if prepared.response is not None:
+                    text, sources = prepared.response.text, prepared.response.sources
+                else:
+                    response = await call_llama_api(prepared.api_request_json)
+                    text, sources = response['choices'][0]['message']['content'], prepared.sources
+                entries.append({"question": question, "answer": text, "sources": sources})
+                logger.info(f"Answered FAQ: {question}")
+            except Exception as e:
+                # Left out of this build and retried by the next populate run
+                logger.error(f"Could not answer FAQ '{question}': {e}")
+                logger.error(traceback.format_exc())
+    finally:
+        await close_llm_client()
+    return entries
+
+
+def refresh_faq_index(manifest: Dict, force: bool = False) -> None:
+    """Regenerate FAQ answers that are missing or older than the documents"""
+    questions = load_faq_questions()
+    fingerprint = documents_fingerprint(manifest)
+    try:
+        current = FAQIndex.load()
+    except FileNotFoundError:
+        current = None
+    except Exception as e:
+        logger.warning(f"Rebuilding unreadable FAQ index: {e}")
+        current = None
+
+    # Answers stay valid only while every document is unchanged
+    reusable: Dict[str, Tuple[Dict, np.ndarray]] = {}
+    if current is not None and current.fingerprint == fingerprint and not force:
+        reusable = {
+            entry["question"]: (entry, vector)
+            for entry, vector in zip(current.entries, current.embeddings)
+        }
+    missing = [question for question in questions if question not in reusable]
+    if current is not None and not missing and len(current) == len(questions):
+        logger.info("FAQ answers are up to date")
+        return
+
+    logger.info(f"Generating {len(missing)} FAQ answers")
+    generated = asyncio.run(generate_answers(missing)) if missing else []
+    vectors = get_retrieval_context().embedding_function.embed_documents(
+        [entry["question"] for entry in generated]
+    ) if generated else []
+    for entry, vector in zip(generated, vectors):
+        reusable[entry["question"]] = (entry, np.asarray(vector, dtype=np.float32))
+
+    kept = [reusable[question] for question in questions if question in reusable]
+    embeddings = np.vstack([vector for _entry, vector in kept]) if kept else np.zeros((0, 0), np.float32)
+    if len(kept):
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    FAQIndex([entry for entry, _vector in kept], embeddings.astype(np.float32), fingerprint).save()
+    logger.info(f"FAQ index written: {len(kept)} of {len(questions)} questions answered")
@@ -1,7 +1,15 @@
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+
+EMBEDDING_RUNTIME = os.getenv("EMBEDDING_RUNTIME", "torch")  # torch, onnx or onnx-int8
 
 def get_embedding_function():
     # Using a lightweight model that's good for text embeddings
     model_name = "all-MiniLM-L6-v2"
+    if EMBEDDING_RUNTIME in ("onnx", "onnx-int8"):
+        # Same model exported to ONNX; torch is never imported
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(quantized=EMBEDDING_RUNTIME == "onnx-int8")
+
+    from langchain_huggingface import HuggingFaceEmbeddings
     embeddings = HuggingFaceEmbeddings(model_name=model_name)
-    return embeddings
\ No newline at end of file
+    return embeddings
@@ -0,0 +1,43 @@
+"""
+Gunicorn settings for multi-worker serving.
+
+The master loads the embedding model once before forking, so every worker
+shares its weights copy-on-write, and each worker then opens its own
+read-only Chroma client. populate_database.py may run alongside: it
+publishes a new index version and every worker switches to it on its own
+(serializing concurrent runs with a file lock).
+
+    gunicorn -c gunicorn.conf.py app.main:app
+"""
+import multiprocessing
+import os
+import sys
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "600"))
+loglevel = os.getenv("LOG_LEVEL", "debug")
+preload_app = True
+
+
+def on_starting(server):
+    """Load the embedding model in the master, before any worker is forked"""
+    # Import the request path too so its modules are shared as well
+    import query_data  # noqa: F401
+    from retrieval_context import get_retrieval_context
+
+    server.log.info("Preloading embedding model in the master process")
+    get_retrieval_context(read_only=True).preload()
+
+
+def post_fork(server, worker):
+    """Split the CPU between workers instead of every worker using all cores"""
+    threads = max(1, multiprocessing.cpu_count() // max(1, server.cfg.workers))
+    # Read by the ONNX runtime when the worker opens its session
+    os.environ.setdefault("EMBEDDING_THREADS", str(threads))
+    # Only the torch runtime imports torch; don't pull it in otherwise
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+    server.log.info(f"Worker {worker.pid} using {threads} inference threads")
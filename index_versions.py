@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHROMA_PATH = "chroma"
+VERSIONS_DIRNAME = "versions"
+CURRENT_FILENAME = "CURRENT"
+RETIRED_FILENAME = ".retired"
+# Marks a version still being built; an interrupted build resumes from it
+BUILDING_FILENAME = ".building"
+SERVING_DIRNAME = "serving"
+# Long enough for every worker to notice the swap and finish its queries
+INDEX_GC_GRACE_SECONDS = float(os.getenv("INDEX_GC_GRACE_SECONDS", "600"))
+# A serving record not refreshed for this long belongs to a process that is gone
+INDEX_SERVING_TTL_SECONDS = float(os.getenv("INDEX_SERVING_TTL_SECONDS", "60"))
+
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+# Files of the root that are not part of an index build
+ROOT_ONLY_FILES = (VERSIONS_DIRNAME, CURRENT_FILENAME, SERVING_DIRNAME, ".cache_generation")
+
+
+def current_version(root: str = CHROMA_PATH) -> Optional[str]:
+    """Version the pointer file names, or None before the first versioned build"""
+    try:
+        with open(os.path.join(root, CURRENT_FILENAME)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if not VERSION_PATTERN.match(version):
+        logger.warning(f"Ignoring malformed index pointer {version!r}")
+        return None
+    return version
+
+
+def version_path(version: Optional[str], root: str = CHROMA_PATH) -> str:
+    """Directory of an index version; the root itself holds the unversioned layout"""
+    if version is None:
+        return root
+    return os.path.join(root, VERSIONS_DIRNAME, version)
+
+
+def current_index_path(root: str = CHROMA_PATH) -> str:
+    return version_path(current_version(root), root)
+
+
+def list_versions(root: str = CHROMA_PATH) -> List[str]:
+    """Every version directory, oldest first"""
+    try:
+        names = os.listdir(os.path.join(root, VERSIONS_DIRNAME))
+    except FileNotFoundError:
+        return []
+    versions = [name for name in names if VERSION_PATTERN.match(name)]
+    return sorted(versions, key=lambda name: int(name[1:]))
+
+
+def build_marker(path: str) -> Optional[Dict]:
+    """What an unpublished build started from, or None for a finished version"""
+    try:
+        with open(os.path.join(path, BUILDING_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # Written before the copy finished; nothing to resume
+        return {}
+
+
+def find_build(root: str = CHROMA_PATH, reset: bool = False) -> Optional[Tuple[str, str]]:
+    """
+    An interrupted build started from the current version, as (version, path)
+
+    Its Chroma database and manifest hold every batch committed before it
+    stopped, so resuming it only embeds what is left.
+    """
+    base_version = current_version(root)
+    for version in reversed(list_versions(root)):
+        path = version_path(version, root)
+        if build_marker(path) == {"base": base_version, "reset": reset}:
+            return version, path
+    return None
+
+
+def create_version(root: str = CHROMA_PATH, base: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Make the directory of the next version, as a copy of base if given
+
+    Returns (version, path). Copying lets an incremental build only embed
+    the files that changed; the copy is never read by the server until it
+    is published. The version is marked as being built, with the version it
+    started from, until publish_version.
+    """
+    versions = list_versions(root)
+    number = int(versions[-1][1:]) + 1 if versions else 1
+    version = f"v{number}"
+    path = version_path(version, root)
+    if base is not None and os.path.isdir(base):
+        ignore = shutil.ignore_patterns(*ROOT_ONLY_FILES, RETIRED_FILENAME, BUILDING_FILENAME, "*.tmp")
+        shutil.copytree(base, path, ignore=ignore)
+    else:
+        os.makedirs(path)
+    # Only once the copy is complete: a half-copied version is not resumed
+    with open(os.path.join(path, BUILDING_FILENAME), "w") as f:
+        json.dump({"base": current_version(root), "reset": base is None}, f)
+    logger.info(f"Building index version {version} in {path}")
+    return version, path
+
+
+def publish_version(version: str, root: str = CHROMA_PATH) -> None:
+    """Atomically point readers at a validated version and retire the previous one"""
+    previous = current_version(root)
+    pointer = os.path.join(root, CURRENT_FILENAME)
+    with open(f"{pointer}.tmp", "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{pointer}.tmp", pointer)
+    try:
+        os.remove(os.path.join(version_path(version, root), BUILDING_FILENAME))
+    except FileNotFoundError:
+        pass
+    if previous is not None and previous != version:
+        with open(os.path.join(version_path(previous, root), RETIRED_FILENAME), "w") as f:
+            f.write(str(time.time()))
+    logger.info(f"Published index version {version} (was {previous or 'unversioned'})")
+
+
+def serving_record_path(root: str = CHROMA_PATH) -> str:
+    return os.path.join(root, SERVING_DIRNAME, f"{socket.gethostname()}-{os.getpid()}")
+
+
+def record_serving(version: Optional[str], root: str = CHROMA_PATH) -> None:
+    """Record the version this process serves; refresh it well within INDEX_SERVING_TTL_SECONDS"""
+    path = serving_record_path(root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        f.write(version or "")
+    os.replace(f"{path}.tmp", path)
+
+
+def clear_serving(root: str = CHROMA_PATH) -> None:
+    """Drop this process's serving record, e.g. on shutdown"""
+    try:
+        os.remove(serving_record_path(root))
+    except FileNotFoundError:
+        pass
+
+
+def serving_versions(root: str = CHROMA_PATH, ttl_seconds: float = INDEX_SERVING_TTL_SECONDS) -> Set[str]:
+    """Versions some live process still serves; stale records are removed"""
+    directory = os.path.join(root, SERVING_DIRNAME)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return set()
+    versions = set()
+    for name in names:
+        if name.endswith(".tmp"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if time.time() - os.stat(path).st_mtime > ttl_seconds:
+                os.remove(path)
+                continue
+            with open(path) as f:
+                version = f.read().strip()
+        except OSError:
+            continue
+        if version:
+            versions.add(version)
+    return versions
+
+
+def collect_garbage(root: str = CHROMA_PATH, grace_seconds: float = INDEX_GC_GRACE_SECONDS) -> List[str]:
+    """
+    Delete versions retired more than grace_seconds ago and no longer served
+
+    Call it while holding the populate lock. An interrupted build started
+    from the current version is kept for the next run to resume; once
+    another version has been published since it started, it goes too, as
+    does a version that is neither current, retired nor being built. A
+    version named in a live serving record is kept, however long ago it was
+    retired, so a worker that could not swap keeps its index.
+    """
+    current = current_version(root)
+    removed = []
+    if current is None:
+        # Nothing was published, so there is no telling which build is live
+        return removed
+    in_use = serving_versions(root)
+    for version in list_versions(root):
+        if version == current:
+            continue
+        if version in in_use:
+            logger.info(f"Keeping retired index version {version}: still served")
+            continue
+        path = version_path(version, root)
+        marker = build_marker(path)
+        if marker and marker.get("base") == current:
+            logger.info(f"Keeping unfinished build of index version {version} to resume")
+            continue
+        try:
+            with open(os.path.join(path, RETIRED_FILENAME)) as f:
+                retired_at = float(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            retired_at = 0.0
+        if retired_at and time.time() - retired_at < grace_seconds:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(version)
+        logger.info(f"Removed index version {version}")
+    return removed
@@ -0,0 +1,141 @@
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i if in is it its
+me my of on or so that the their then there this to was what when where which
+who why will with you your
+""".split())
+
+
+def normalize_term(term: str) -> str:
+    """Fold simple plurals ("hotels", "mortgages") onto the singular"""
+    if len(term) > 3 and term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        return term[:-1]
+    return term
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms without stopwords"""
+    return [
+        normalize_term(term) for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS
+    ]
+
+
+def lexical_index_path(directory: str, collection_name: str) -> str:
+    return os.path.join(directory, f"{collection_name}.bm25.npz")
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over one collection snapshot
+
+    Postings are stored CSR-style: the rows and precomputed BM25 weights of
+    term t are rows[offsets[t]:offsets[t + 1]]. Since a term's weight in a
+    chunk does not depend on the query, a lookup is one slice and one
+    scatter-add per query term. Rows index the chunk IDs saved with the
+    postings, built from the same snapshot as the vector index.
+    """
+
+    def __init__(self, name: str, terms: Sequence[str], offsets: np.ndarray,
+                 rows: np.ndarray, weights: np.ndarray, ids: Sequence[str]):
+        self.name = name
+        self.terms = {term: position for position, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.ids = list(ids)
+
+    @classmethod
+    def build(cls, name: str, ids: Sequence[str], documents: Sequence[str],
+              k1: float = BM25_K1, b: float = BM25_B) -> "LexicalIndex":
+        """Tokenize the chunks and precompute every posting's BM25 weight"""
+        term_counts = [Counter(tokenize(document)) for document in documents]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) and lengths.sum() else 1.0
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for row, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((row, count))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        rows: List[int] = []
+        weights: List[float] = []
+        total = len(documents)
+        for position, term in enumerate(terms):
+            entries = postings[term]
+            idf = math.log(1 + (total - len(entries) + 0.5) / (len(entries) + 0.5))
+            for row, count in entries:
+                norm = k1 * (1 - b + b * lengths[row] / average_length)
+                rows.append(row)
+                weights.append(idf * count * (k1 + 1) / (count + norm))
+            offsets[position + 1] = len(rows)
+
+        return cls(
+            name, terms, offsets,
+            np.asarray(rows, dtype=np.int32), np.asarray(weights, dtype=np.float32), ids,
+        )
+
+    def save(self, directory: str) -> str:
+        path = lexical_index_path(directory, self.name)
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(
+                f,
+                terms=np.asarray(list(self.terms), dtype=str),
+                offsets=self.offsets,
+                rows=self.rows,
+                weights=self.weights,
+                ids=np.asarray(self.ids, dtype=str),
+            )
+        os.replace(f"{path}.tmp", path)
+        logger.info(f"Wrote BM25 index of {self.name}: {len(self.terms)} terms, {len(self.rows)} postings")
+        return path
+
+    @classmethod
+    def load(cls, directory: str, collection_name: str) -> "LexicalIndex":
+        with np.load(lexical_index_path(directory, collection_name), allow_pickle=False) as data:
+            return cls(
+                collection_name, data["terms"].tolist(), data["offsets"],
+                data["rows"], data["weights"], data["ids"].tolist(),
+            )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query_text: str, k: int = 5) -> List[Tuple[str, float]]:
+        """Top-k (chunk ID, BM25 score) pairs, best first; chunks sharing no term are skipped"""
+        scores = None
+        for term, count in Counter(tokenize(query_text)).items():
+            position = self.terms.get(term)
+            if position is None:
+                continue
+            start, end = self.offsets[position], self.offsets[position + 1]
+            if scores is None:
+                scores = np.zeros(len(self.ids), dtype=np.float32)
+            # A term lists each row once, so the fancy-indexed add is safe
+            scores[self.rows[start:end]] += count * self.weights[start:end]
+        if scores is None:
+            return []
+
+        matched = np.flatnonzero(scores)
+        if k < len(matched):
+            matched = matched[np.argpartition(-scores[matched], k)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(self.ids[row], float(scores[row])) for row in matched]
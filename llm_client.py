@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+LLAMA_API_URL = os.getenv("LLAMA_API_URL", "https://api.llama-api.com")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # seconds
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+
+
+class LLMError(Exception):
+    """The LLM API returned an error or an unusable response"""
+
+
+class LLMOverloadedError(LLMError):
+    """Too many requests are already waiting for an LLM slot"""
+
+
+class LLMClient:
+    """Interface for chat completion backends"""
+
+    async def complete(self, request_json: Dict, timeout: Optional[float] = None) -> Dict:
+        """Return the full chat completion response"""
+        raise NotImplementedError
+
+    def stream(self, request_json: Dict, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Yield completion text fragments as they arrive"""
+        raise NotImplementedError
+
+    @property
+    def overloaded(self) -> bool:
+        """Whether a new request would be rejected right now"""
+        return False
+
+    async def aclose(self) -> None:
+        pass
+
+
+class OpenAICompatibleClient(LLMClient):
+    """
+    Chat completions over one pooled HTTP client
+
+    Works against LlamaAPI and any OpenAI-compatible server. At most
+    max_concurrency requests run at once; up to max_queue more wait for a
+    slot, and anything beyond that fails fast with LLMOverloadedError.
+    """
+
+    def __init__(self, base_url: str = LLAMA_API_URL, api_key: Optional[str] = None,
+                 timeout: float = LLM_TIMEOUT, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_queue: int = LLM_MAX_QUEUE):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+
+    @property
+    def overloaded(self) -> bool:
+        return self._in_flight >= self.max_concurrency and self._waiting >= self.max_queue
+
+    async def _acquire(self) -> None:
+        if self.overloaded:
+            raise LLMOverloadedError(
+                f"LLM queue full ({self._in_flight} in flight, {self._waiting} waiting)"
+            )
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    async def complete(self, request_json: Dict, timeout: Optional[float] = None) -> Dict:
+        timeout = self.timeout if timeout is None else timeout
+        await self._acquire()
+        try:
+            start_time = time.time()
+            response = await asyncio.wait_for(
+                self._client.post("/chat/completions", json=dict(request_json, stream=False)),
+                timeout
+            )
+            logger.info(f"API Response Time: {time.time() - start_time:.2f} seconds")
+            logger.info(f"API Response Status: {response.status_code}")
+            logger.debug(f"API Response Content: {response.text}")
+
+            if response.status_code != 200:
+                logger.error(f"LlamaAPI error: Status {response.status_code}")
+                raise LLMError(f"API call failed with status {response.status_code}")
+            return response.json()
+        finally:
+            self._release()
+
+    async def stream(self, request_json: Dict, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        timeout = self.timeout if timeout is None else timeout
+        await self._acquire()
+        try:
+            start_time = time.time()
+            request = self._client.stream(
+                "POST", "/chat/completions",
+                json=dict(request_json, stream=True),
+                timeout=httpx.Timeout(timeout),
+            )
+            async with request as response:
+                if response.status_code != 200:
+                    logger.error(f"LlamaAPI error: Status {response.status_code}")
+                    raise LLMError(f"API call failed with status {response.status_code}")
+
+                first_token = True
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    choices = json.loads(data).get("choices") or [{}]
+                    token = (choices[0].get("delta") or {}).get("content")
+                    if token:
+                        if first_token:
+                            logger.info(f"API Time to First Token: {time.time() - start_time:.2f} seconds")
+                            first_token = False
+                        yield token
+
+            logger.info(f"API Stream Time: {time.time() - start_time:.2f} seconds")
+        finally:
+            self._release()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """Return the process-wide LLM client, created on first use inside the event loop"""
+    global _client
+    if _client is None:
+        api_key = os.getenv("LLAMA_API_KEY")
+        if not api_key:
+            logger.warning("LLAMA_API_KEY not found in environment variables")
+        _client = OpenAICompatibleClient(api_key=api_key)
+        logger.info(f"LLM client: {LLAMA_API_URL} (max {LLM_MAX_CONCURRENCY} concurrent)")
+    return _client
+
+
+def set_llm_client(client: Optional[LLMClient]) -> None:
+    """Swap the LLM backend, e.g. for a local stand-in"""
+    global _client
+    _client = client
+
+
+async def close_llm_client() -> None:
+    """Close the pooled connections on shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
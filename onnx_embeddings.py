@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tokenizer threads do not survive a fork; batches are small anyway
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+ONNX_MODEL_REPO = os.getenv("EMBEDDING_ONNX_REPO", "sentence-transformers/all-MiniLM-L6-v2")
+ONNX_MODEL_DIR = os.getenv("EMBEDDING_ONNX_DIR")  # local export instead of the Hub repo
+ONNX_MODEL_FILE = "onnx/model.onnx"
+# Dynamically quantized int8 weights published alongside the fp32 export
+ONNX_INT8_MODEL_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+MAX_SEQUENCE_LENGTH = 256  # sentence-transformers' limit for all-MiniLM-L6-v2
+EMBED_BATCH_SIZE = 32
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime, without torch or transformers
+
+    Mirrors the sentence-transformers pipeline: WordPiece tokenization,
+    mean pooling over the attention mask, then L2 normalization. Files are
+    fetched up front (also before a fork), but the inference session is
+    created per process because ONNX Runtime thread pools do not survive
+    fork; EMBEDDING_THREADS caps its intra-op threads.
+    """
+
+    def __init__(self, quantized: bool = False, model_dir: Optional[str] = ONNX_MODEL_DIR,
+                 repo_id: str = ONNX_MODEL_REPO):
+        from tokenizers import Tokenizer
+
+        self.model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.model_path = self._resolve(self.model_file, model_dir, repo_id)
+        self.tokenizer = Tokenizer.from_file(self._resolve("tokenizer.json", model_dir, repo_id))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQUENCE_LENGTH)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+        self._input_names: List[str] = []
+
+    @staticmethod
+    def _resolve(filename: str, model_dir: Optional[str], repo_id: str) -> str:
+        if model_dir:
+            return os.path.join(model_dir, filename)
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(repo_id=repo_id, filename=filename)
+
+    @property
+    def session(self):
+        """ONNX Runtime session of the current process"""
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    import onnxruntime as ort
+
+                    options = ort.SessionOptions()
+                    threads = int(os.getenv("EMBEDDING_THREADS", "0"))
+                    if threads:
+                        options.intra_op_num_threads = threads
+                    options.inter_op_num_threads = 1
+                    logger.info(f"Loading ONNX embedding model {self.model_path} (pid {os.getpid()})")
+                    self._session = ort.InferenceSession(
+                        self.model_path, options, providers=["CPUExecutionProvider"]
+                    )
+                    self._input_names = [model_input.name for model_input in self._session.get_inputs()]
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs: Dict[str, np.ndarray] = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        session = self.session
+        token_embeddings = session.run(None, {name: inputs[name] for name in self._input_names})[0]
+
+        # Mean pooling over real tokens, then unit length
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [
+            self._embed_batch(texts[start:start + EMBED_BATCH_SIZE])
+            for start in range(0, len(texts), EMBED_BATCH_SIZE)
+        ]
+        return np.vstack(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0].tolist()
@@ -1,65 +1,107 @@
 import os
 import traceback
-from typing import List
-import shutil
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import glob
+import hashlib
+import json
 import time
 
-from langchain_community.document_loaders.pdf import PyPDFDirectoryLoader
+from langchain_community.document_loaders.pdf import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.schema.document import Document
-from get_embedding_function import get_embedding_function
-from langchain_chroma import Chroma
-import chromadb
+from langchain_core.documents import Document
+from retrieval_context import (
+    CHROMA_PATH, COLLECTION_NAMES, RetrievalContext, get_retrieval_context, set_retrieval_context
+)
+from index_versions import (
+    collect_garbage, create_version, current_index_path, current_version, find_build, publish_version
+)
+from lexical_index import LexicalIndex, lexical_index_path
+from vector_index import VectorIndex, snapshot_paths, write_snapshot
+from faq_index import refresh_faq_index
+from response_cache import invalidate_response_cache
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-CHROMA_PATH = "chroma"
 DATA_PATH = "data"
+MANIFEST_FILENAME = "ingest_manifest.json"
+# Next to the database rather than inside it, so no build can delete it
+POPULATE_LOCK_PATH = f"{CHROMA_PATH}.lock"
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+DEFAULT_WORKERS = max(1, min(4, os.cpu_count() or 1))
 
 
-def safe_remove_dir_contents(directory: str):
-    """Safely remove directory contents without removing the directory itself"""
-    logger.info(f"Attempting to clear contents of {directory}")
+@contextmanager
+def populate_lock():
+    """Hold an exclusive lock so concurrent populate runs take turns"""
     try:
-        if os.path.exists(directory):
-            for item in os.listdir(directory):
-                item_path = os.path.join(directory, item)
-                try:
-                    if os.path.isfile(item_path):
-                        os.unlink(item_path)
-                        logger.info(f"Removed file: {item_path}")
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path)
-                        logger.info(f"Removed directory: {item_path}")
-                except Exception as e:
-                    logger.warning(f"Could not remove {item_path}: {e}")
-    except Exception as e:
-        logger.warning(f"Error clearing directory {directory}: {e}")
+        import fcntl
+    except ImportError:
+        # No flock on this platform; runs are not serialized
+        yield
+        return
+
+    with open(POPULATE_LOCK_PATH, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Another populate run holds the lock, waiting for it to finish...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def list_data_files() -> List[str]:
+    """List every PDF under the data directory"""
+    pattern = os.path.join(DATA_PATH, "**", "[!.]*.pdf")
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+def file_sha256(path: str) -> str:
+    """Hash a file's content in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def collection_for_source(source_path: str) -> Optional[str]:
+    """Map a document source path to its Chroma collection"""
+    if 'game_rules' in source_path:
+        return "game_rules"
+    elif 'platform_docs' in source_path:
+        return "platform_docs"
+    return None
 
 
-def load_documents():
-    """Load documents from the data directory"""
-    logger.info(f"📚 Loading documents from: {DATA_PATH}")
+def load_manifest(directory: str) -> Dict:
+    """Load the per-file ingestion manifest of an index"""
+    path = os.path.join(directory, MANIFEST_FILENAME)
     try:
-        document_loader = PyPDFDirectoryLoader(DATA_PATH)
-        documents = document_loader.load()
-
-        logger.info("\nLoaded files:")
-        sources = set()
-        for doc in documents:
-            source = doc.metadata.get("source", "Unknown")
-            if source not in sources:
-                sources.add(source)
-                logger.info(f"- {source}")
-        logger.info(f"\nTotal documents loaded: {len(documents)}")
-
-        return documents
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
     except Exception as e:
-        logger.error(f"Error loading documents: {e}")
-        raise
+        logger.warning(f"Ignoring unreadable manifest {path}: {e}")
+        return {"files": {}}
+
+
+def save_manifest(manifest: Dict, directory: str) -> None:
+    """Atomically write the per-file ingestion manifest of an index"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
 
 
 def split_documents(documents: list[Document]):
@@ -77,82 +119,373 @@ def split_documents(documents: list[Document]):
         raise
 
 
-def add_to_chroma(documents: List) -> None:
-    """Add documents to Chroma collections based on their source paths"""
-    try:
-        client = chromadb.PersistentClient(path=CHROMA_PATH)
-        embedding_function = get_embedding_function()
-
-        # Separate documents by type
-        game_docs = []
-        platform_docs = []
-
-        for doc in documents:
-            source_path = doc.metadata['source']
-            if 'game_rules' in source_path:
-                game_docs.append(doc)
-            elif 'platform_docs' in source_path:
-                platform_docs.append(doc)
-
-        logger.info(f"Found {len(game_docs)} game documents and {len(platform_docs)} platform documents")
-
-        # Handle game rules documents
-        if game_docs:
-            game_db = Chroma(
-                client=client,
-                collection_name="game_rules",
-                embedding_function=embedding_function,
-            )
-            game_db.add_documents(game_docs)
-            logger.info(f"Added {len(game_docs)} documents to game_rules collection")
-
-        # Handle platform documents
-        if platform_docs:
-            platform_db = Chroma(
-                client=client,
-                collection_name="platform_docs",
-                embedding_function=embedding_function,
+def calculate_chunk_ids(chunks: List[Document]) -> List[Document]:
+    """Give every chunk a deterministic ID: source:page:chunk index:content hash"""
+    page_counts: Dict[str, int] = {}
+    for chunk in chunks:
+        source = chunk.metadata.get("source")
+        page = chunk.metadata.get("page")
+        page_key = f"{source}:{page}"
+        index = page_counts.get(page_key, 0)
+        page_counts[page_key] = index + 1
+
+        content_hash = hashlib.sha1(chunk.page_content.encode("utf-8")).hexdigest()[:12]
+        chunk.metadata["id"] = f"{page_key}:{index}:{content_hash}"
+    return chunks
+
+
+class ChromaBatchWriter:
+    """Embed chunk batches while the previous batch is upserted into Chroma"""
+
+    def __init__(self, batch_size: int = INGEST_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.context = get_retrieval_context()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_write: Optional[Future] = None
+        self.chunks_written = 0
+        self.chunks_skipped = 0
+        self.batches = 0
+        self.embed_seconds = 0.0
+        self.start_time = time.time()
+
+    def write(self, collection_name: str, chunks: Iterable[Document]) -> int:
+        """Embed and upsert chunks in batches; returns how many were written"""
+        written = 0
+        for batch in iter_batches(chunks, self.batch_size):
+            written += self._write_batch(collection_name, batch)
+        return written
+
+    def _write_batch(self, collection_name: str, batch: List[Document]) -> int:
+        collection = self.context.get_collection(collection_name)
+
+        # Chunks committed by an interrupted run are already there; skip them
+        ids = [chunk.metadata["id"] for chunk in batch]
+        committed = set(collection.get(ids=ids, include=[])["ids"])
+        if committed:
+            batch = [chunk for chunk in batch if chunk.metadata["id"] not in committed]
+            self.chunks_skipped += len(committed)
+        if not batch:
+            return 0
+
+        texts = [chunk.page_content for chunk in batch]
+        embed_start = time.perf_counter()
+        embeddings = self.context.embedding_function.embed_documents(texts)
+        embed_elapsed = time.perf_counter() - embed_start
+        self.embed_seconds += embed_elapsed
+        self.batches += 1
+        logger.info(
+            f"Embedded batch of {len(batch)} chunks for {collection_name} "
+            f"in {embed_elapsed * 1000:.0f} ms"
+        )
+
+        # Only one upsert in flight: it overlaps with embedding the next batch
+        self.flush()
+        self._pending_write = self._executor.submit(
+            collection.upsert,
+            ids=[chunk.metadata["id"] for chunk in batch],
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=[chunk.metadata for chunk in batch],
+        )
+        self.chunks_written += len(batch)
+        return len(batch)
+
+    def flush(self) -> None:
+        """Wait until every submitted batch is committed"""
+        if self._pending_write is not None:
+            pending, self._pending_write = self._pending_write, None
+            pending.result()
+
+    def close(self) -> None:
+        """Commit the last batch and log throughput"""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        mean_embed_ms = self.embed_seconds / self.batches * 1000 if self.batches else 0.0
+        logger.info(
+            f"Ingested {self.chunks_written} chunks in {elapsed:.1f}s "
+            f"({self.chunks_written / elapsed:.1f} chunks/sec, "
+            f"{mean_embed_ms:.0f} ms/batch embedding over {self.batches} batches, "
+            f"{self.chunks_skipped} already committed)"
+        )
+
+
+def delete_from_chroma(ids_by_collection: Dict[str, List[str]]) -> None:
+    """Remove chunks by ID from their collections"""
+    context = get_retrieval_context()
+    for collection_name, ids in ids_by_collection.items():
+        if not ids:
+            continue
+        context.get_db(collection_name).delete(ids=ids)
+        logger.info(f"Removed {len(ids)} stale chunks from {collection_name} collection")
+
+
+def plan_ingestion(manifest: Dict, paths: List[str]):
+    """Split data files into changed and deleted files relative to the manifest"""
+    files = manifest.setdefault("files", {})
+    changed = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = files.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            continue
+
+        digest = file_sha256(path)
+        if entry and entry["sha256"] == digest:
+            # Touched but identical: remember the new mtime and move on
+            entry["mtime_ns"] = stat.st_mtime_ns
+            entry["size"] = stat.st_size
+            continue
+        changed.append((path, stat, digest))
+
+    deleted = sorted(set(files) - set(paths))
+    return changed, deleted
+
+
+def parse_and_split(path: str) -> List[Document]:
+    """Load and chunk one PDF; runs inside a pool worker"""
+    return calculate_chunk_ids(split_documents(PyPDFLoader(path).load()))
+
+
+def iter_file_chunks(paths: List[str], workers: int = DEFAULT_WORKERS) -> Iterator[Tuple[str, List[Document]]]:
+    """Yield (path, chunks) as each file finishes parsing in a process pool"""
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield path, parse_and_split(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(paths)
+        pending = {}
+
+        def submit_next() -> None:
+            path = next(remaining, None)
+            if path is not None:
+                pending[pool.submit(parse_and_split, path)] = path
+
+        # Bound the parsed-but-unwritten files so memory stays flat
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                submit_next()
+                yield path, future.result()
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def sync_file(manifest: Dict, path: str, stat, digest: str, chunks: List[Document],
+              writer: ChromaBatchWriter) -> int:
+    """Upsert the new chunks of one changed file and drop its stale ones"""
+    files = manifest["files"]
+    collection_name = collection_for_source(path)
+    old_ids = set(files.get(path, {}).get("chunk_ids", []))
+    new_ids = [chunk.metadata["id"] for chunk in chunks]
+
+    stale_ids = sorted(old_ids - set(new_ids))
+    if collection_name and stale_ids:
+        delete_from_chroma({collection_name: stale_ids})
+
+    added = (chunk for chunk in chunks if chunk.metadata["id"] not in old_ids)
+    added_count = 0
+    if collection_name:
+        added_count = writer.write(collection_name, added)
+        # The manifest may only record chunks that are committed
+        writer.flush()
+
+    files[path] = {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": digest,
+        "collection": collection_name,
+        "chunk_ids": new_ids,
+    }
+    logger.info(f"Synced {path}: {added_count} upserted, {len(stale_ids)} removed")
+    return added_count + len(stale_ids)
+
+
+def write_vector_snapshots(force: bool = False) -> None:
+    """Snapshot every collection for the numpy backend, with its BM25 index"""
+    context = get_retrieval_context()
+    directory = context.index_path
+    missing = [
+        name for name in COLLECTION_NAMES
+        if not all(os.path.exists(path) for path in snapshot_paths(directory, name))
+        or not os.path.exists(lexical_index_path(directory, name))
+    ]
+    if not force and not missing:
+        return
+    for name in COLLECTION_NAMES:
+        write_snapshot(context.get_collection(name), directory)
+        snapshot = VectorIndex.load(directory, name)
+        LexicalIndex.build(name, snapshot.ids, snapshot.chunks.texts()).save(directory)
+
+
+def validate_index(context: RetrievalContext, manifest: Dict) -> None:
+    """Check a build before readers are pointed at it; raises ValueError if it is incomplete"""
+    expected: Dict[str, List[str]] = {name: [] for name in COLLECTION_NAMES}
+    for entry in manifest["files"].values():
+        if entry.get("collection") in expected:
+            expected[entry["collection"]].extend(entry["chunk_ids"])
+
+    for name in COLLECTION_NAMES:
+        count = context.get_collection(name).count()
+        snapshot = VectorIndex.load(context.index_path, name)
+        lexical = LexicalIndex.load(context.index_path, name)
+        if not count == len(snapshot) == len(lexical):
+            raise ValueError(
+                f"{name}: {count} chunks in Chroma, {len(snapshot)} in the snapshot, {len(lexical)} in BM25"
             )
-            platform_db.add_documents(platform_docs)
-            logger.info(f"Added {len(platform_docs)} documents to platform_docs collection")
+        missing = [chunk_id for chunk_id in expected[name] if chunk_id not in snapshot.rows]
+        if missing:
+            raise ValueError(f"{name} is missing {len(missing)} chunks listed in the manifest, e.g. {missing[0]}")
+        # A chunk's own vector must come back as an exact match
+        if count:
+            doc, distance = snapshot.search(snapshot.embeddings[0], k=1)[0]
+            if distance > 1e-3:
+                raise ValueError(f"{name}: search for chunk {snapshot.ids[0]} returned {doc.id} at {distance}")
+        logger.info(f"Validated {name}: {count} chunks")
 
-    except Exception as e:
-        logger.error(f"Error adding documents to Chroma: {e}")
-        logger.error(traceback.format_exc())
-        raise
 
+def use_index(path: str, version: Optional[str]) -> RetrievalContext:
+    """Point the process-wide context, which populate writes through, at an index"""
+    context = get_retrieval_context()
+    if context.chroma_path != path:
+        context = context.for_version(version, path)
+        set_retrieval_context(context)
+    return context
 
-def main():
-    """Main function to populate the database"""
+
+def sync_files(args, manifest: Dict, changed: List, deleted: List[str], directory: str) -> None:
+    """Upsert changed files and drop deleted ones in the index being written"""
+    # Parse in the pool before the embedding model or Chroma client is
+    # loaded, so forked workers start from a light parent process
+    changed_by_path = {path: (stat, digest) for path, stat, digest in changed}
+    writer = None
     try:
-        import argparse
-        parser = argparse.ArgumentParser()
-        parser.add_argument("--reset", action="store_true", help="Reset the database")
-        args = parser.parse_args()
+        for path, chunks in iter_file_chunks(list(changed_by_path), args.workers):
+            if writer is None:
+                writer = ChromaBatchWriter(args.batch_size)
+            stat, digest = changed_by_path[path]
+            sync_file(manifest, path, stat, digest, chunks, writer)
+            save_manifest(manifest, directory)
+    finally:
+        if writer is not None:
+            writer.close()
 
-        if args.reset:
-            logger.info("✨ Clearing Database")
-            safe_remove_dir_contents(CHROMA_PATH)
+    # Drop every chunk of files that no longer exist
+    for path in deleted:
+        entry = manifest["files"].pop(path)
+        if entry.get("collection"):
+            delete_from_chroma({entry["collection"]: entry["chunk_ids"]})
+        logger.info(f"Removed deleted file {path}")
+    save_manifest(manifest, directory)
 
-        # Load and process documents
-        documents = load_documents()
-        chunks = split_documents(documents)
 
-        # Get existing document count
-        try:
-            client = chromadb.PersistentClient(path=CHROMA_PATH)
-            game_collection = client.get_collection("game_rules")
-            platform_collection = client.get_collection("platform_docs")
-            existing_count = len(game_collection.get()['ids']) + len(platform_collection.get()['ids'])
-        except Exception:
-            existing_count = 0
+def build_version(args, base: str, manifest: Dict, changed: List, deleted: List[str],
+                  resume: Optional[Tuple[str, str]] = None) -> str:
+    """
+    Write a new index version next to the live one, validate it and publish it
+
+    The build starts from a copy of the live index (empty with --reset), so
+    only changed files are embedded, or carries on with the unfinished build
+    in resume. Until the pointer moves, the server keeps reading the live
+    version. A failed build is kept, so the next run resumes from its last
+    committed batch.
+    """
+    if resume is not None:
+        version, path = resume
+        logger.info(f"Resuming unfinished build of index version {version}")
+    else:
+        version, path = create_version(base=None if args.reset else base)
+    context = use_index(path, version)
+    try:
+        sync_files(args, manifest, changed, deleted, path)
+        write_vector_snapshots(force=True)
+        validate_index(context, manifest)
+        # Answered from the new version, so the FAQ matches what it serves
+        if not args.no_faq:
+            refresh_faq_index(manifest, force=args.rebuild_faq)
+    except BaseException:
+        logger.error(f"Build of index version {version} failed; the next run resumes it")
+        context.close()
+        raise
+    context.close()
+
+    publish_version(version)
+    invalidate_response_cache()
+    return version
 
-        logger.info(f"Number of existing documents in DB: {existing_count}")
-        logger.info(f"👉 Adding new documents: {len(chunks)}")
 
-        # Add to database
-        add_to_chroma(chunks)
-        logger.info("✅ Database population completed successfully")
+def populate(args) -> None:
+    """Sync the index with data/; the caller holds the populate lock"""
+    start_time = time.time()
+    base = current_index_path()
+    resume = find_build(reset=args.reset)
+    if resume is not None:
+        # Lists the files the interrupted build already synced
+        manifest = load_manifest(resume[1])
+    else:
+        manifest = {"files": {}} if args.reset else load_manifest(base)
+    changed, deleted = plan_ingestion(manifest, list_data_files())
+    logger.info(f"👉 {len(changed)} changed files, {len(deleted)} deleted files")
+
+    if resume is not None or args.reset or changed or deleted:
+        version = build_version(args, base, manifest, changed, deleted, resume)
+    else:
+        # Nothing to re-embed: fill in missing snapshots or FAQ answers in
+        # place, with the same atomic file replacements readers reload on
+        version = current_version()
+        use_index(base, version)
+        save_manifest(manifest, base)
+        write_vector_snapshots()
+        if not args.no_faq:
+            refresh_faq_index(manifest, force=args.rebuild_faq)
+
+    collect_garbage()
+    logger.info(
+        f"✅ Database population completed successfully in {time.time() - start_time:.1f}s "
+        f"(index version {version or 'unversioned'})"
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    """Main function to populate the database"""
+    try:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--reset", action="store_true",
+                            help="Build a new index version from scratch instead of from the live one")
+        parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                            help="Processes used to parse and chunk PDFs")
+        parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE,
+                            help="Chunks embedded and upserted per batch")
+        parser.add_argument("--rebuild-faq", action="store_true",
+                            help="Regenerate every FAQ answer")
+        parser.add_argument("--no-faq", action="store_true",
+                            help="Skip FAQ answer generation, which calls the LLM")
+        args = parser.parse_args(argv)
+
+        # Several workers or containers may start at once; the second run
+        # waits and then finds nothing left to do
+        with populate_lock():
+            populate(args)
 
     except Exception as e:
         logger.error(f"Error in main function: {e}")
@@ -161,4 +494,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,6 +2,6 @@
 echo "Running post-deployment tasks..."
 
 # Initialize the database
-python populate_database.py --reset
+python populate_database.py
 
 echo "Post-deployment tasks completed."
\ No newline at end of file
@@ -1,17 +1,26 @@
 import asyncio
-import os
-from llamaapi import LlamaAPI
 
+import os
 import traceback
-from typing import Dict, List
-from langchain_chroma import Chroma
-import chromadb
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional
 from dotenv import load_dotenv
-from get_embedding_function import get_embedding_function
+from retrieval_context import RetrievalContext, get_retrieval_context
+from retrieval import RETRIEVAL_MODE, collections_for, search_collections
+from context_builder import CONTEXT_FETCH_K, build_context, extractive_answer
+from faq_index import get_faq_index
+from query_router import (  # noqa: F401 - the pattern lists used to live here
+    GAME_COLLECTION, GAME_PATTERNS, GENERAL_PATTERNS, PLATFORM_COLLECTION, PLATFORM_PATTERNS,
+    RouteDecision, compile_patterns, get_query_router, route_query,
+)
+from embedding_batcher import get_embedding_batcher
+from response_cache import get_response_cache, normalize_query
+from singleflight import SingleFlight
+from metrics import StageTimer
+from llm_client import LLMOverloadedError, get_llm_client
+from circuit_breaker import CircuitOpenError, Deadline, DeadlineExceeded, get_llm_breaker
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
 import json
-from functools import partial
 import time
 
 # Configure logging
@@ -22,124 +31,102 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 
-class CustomLlamaAPI:
-    """Wrapper for LlamaAPI to avoid nest_asyncio issues"""
-
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self._api = None
-
-    def _ensure_api(self):
-        """Ensure API instance exists in current context"""
-        if self._api is None:
-            # Create new instance without nest_asyncio
-            import llamaapi.llamaapi
-            # Temporarily patch the __init__ to skip nest_asyncio
-            original_init = llamaapi.llamaapi.LlamaAPI.__init__
-            try:
-                llamaapi.llamaapi.LlamaAPI.__init__ = lambda self, api_key: setattr(self, 'api_key', api_key)
-                self._api = LlamaAPI(self.api_key)
-            finally:
-                llamaapi.llamaapi.LlamaAPI.__init__ = original_init
-        return self._api
-
-    def run(self, *args, **kwargs):
-        """Run API call using current context"""
-        api = self._ensure_api()
-        return api.run(*args, **kwargs)
-
-
-def init_llama_api():
-    """Initialize custom LlamaAPI wrapper"""
-    logger.info(f"Using API Key: {'*' * (len(os.getenv('LLAMA_API_KEY')) - 4)}{os.getenv('LLAMA_API_KEY')[-4:]}")
-    try:
-        if not os.getenv('LLAMA_API_KEY'):
-            raise ValueError("LLAMA_API_KEY not found in environment variables")
-        return CustomLlamaAPI(os.getenv('LLAMA_API_KEY'))
-    except Exception as e:
-        logger.error(f"Error initializing LlamaAPI: {str(e)}")
-        raise
-
-
-# Initialize LlamaAPI
-llama = init_llama_api()
 # Constants
-CHROMA_PATH = "chroma"
 API_TIMEOUT = 30  # seconds
 MAX_RETRIES = 3
-
-# Query type patterns
-GENERAL_PATTERNS = [
-    'hello', 'hi', 'hey', 'help', 'can you', 'what can you do',
-    'who are you', 'how do you', 'thanks', 'thank you', 'bye'
-]
-
-GAME_PATTERNS = [
-    'battleship', 'battleships', 'chess', 'monopoly',
-    'reversi', 'tictactoe', 'tic-tac-toe'
-]
-
-PLATFORM_PATTERNS = [
-    'how to', 'where', 'find', 'navigate', 'use', 'access',
-    'menu', 'search', 'platform', 'website', 'guide', 'store',
-    'purchase', 'buy', 'game store', 'available games',
-    'list', 'account', 'create account'
-]
-
+RETRY_BACKOFF_SECONDS = 0.5
+# Below this much of the request deadline, answer extractively instead of calling the LLM
+LLM_MIN_SECONDS = float(os.getenv("LLM_MIN_SECONDS", "3"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "8"))
 
 class QueryResponse:
-    """Structure for handling query responses"""
+    """
+    Structured result of a query
 
-    def __init__(self, text: str, sources: List[str]):
+    cache says where the answer came from: "miss" (generated by the LLM),
+    "exact" or "semantic" (response cache), "faq" (precomputed answer),
+    "extractive" (quoted from the retrieved chunks while the LLM was
+    unavailable) or "none" (canned reply, nothing looked up). scores are the distances of
+    the chunks behind the sources, when there are any.
+    """
+
+    def __init__(self, text: str, sources: List[str], timings: Optional[Dict[str, float]] = None,
+                 scores: Optional[List[float]] = None, route: Optional[RouteDecision] = None,
+                 cache: str = "none"):
         self.text = text
         self.sources = sources
+        self.timings = timings or {}
+        self.scores = scores
+        self.route = route
+        self.cache = cache
+
+    def copy(self, **changes) -> "QueryResponse":
+        """A new response with some fields replaced; shared responses stay untouched"""
+        fields = {
+            "text": self.text, "sources": self.sources, "timings": dict(self.timings),
+            "scores": self.scores, "route": self.route, "cache": self.cache,
+        }
+        fields.update(changes)
+        return QueryResponse(**fields)
 
     def format(self) -> str:
         """Format the response for output"""
         return f"Response: {self.text}\nSources: {json.dumps(self.sources)}"
 
+    def to_dict(self) -> Dict:
+        """Serialize the response for the response cache"""
+        return {"text": self.text, "sources": self.sources, "scores": self.scores}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "QueryResponse":
+        """Rebuild a response stored in the response cache"""
+        return cls(data["text"], data["sources"], scores=data.get("scores"))
+
+
+_compiled_patterns = lru_cache(maxsize=32)(compile_patterns)
+
+GREETING_PATTERN = compile_patterns(['hello', 'hi', 'hey', 'greetings'])
+HELP_PATTERN = compile_patterns(['help', 'can you', 'what can you do'])
+
 
 def is_pattern_match(query: str, patterns: List[str]) -> bool:
-    """Check if query matches any patterns"""
-    query_lower = query.lower()
-    return any(pattern in query_lower for pattern in patterns)
+    """Check if query contains any of the patterns as whole words"""
+    return _compiled_patterns(tuple(patterns)).search(query) is not None
 
 
 def is_general_query(query: str) -> bool:
-    return is_pattern_match(query, GENERAL_PATTERNS)
+    return "general" in get_query_router().matches(query)
 
 
 def is_game_query(query: str) -> bool:
-    return is_pattern_match(query, GAME_PATTERNS)
+    return "game" in get_query_router().matches(query)
 
 
 def is_platform_query(query: str) -> bool:
-    result = is_pattern_match(query, PLATFORM_PATTERNS)
-    logger.info(f"Query '{query}' platform match: {result}")
+    result = "platform" in get_query_router().matches(query)
+    logger.debug(f"Query '{query}' platform match: {result}")
     return result
 
 
-def get_general_response(query: str) -> QueryResponse:
-    """Generate responses for general queries"""
-    query_lower = query.lower().strip('?!., ')
+def choose_collection(query: str) -> str:
+    """Pick the collection searched for a non-general query"""
+    return PLATFORM_COLLECTION if is_platform_query(query) else GAME_COLLECTION
 
-    # Greeting response
-    if any(greeting in query_lower for greeting in ['hello', 'hi', 'hey', 'greetings']):
-        return QueryResponse(
-            text="""Hello! 👋 I'm your Game Rules Assistant. I can help you with:
+
+# Canned replies for general queries, built once at import
+GREETING_RESPONSE = QueryResponse(
+    text="""Hello! 👋 I'm your Game Rules Assistant. I can help you with:
 
             1. Game Rules: Learn how to play various games
             2. Platform Navigation: Find your way around
             3. General Questions: Get help with using the platform
             
             How can I assist you today?""",
-                        sources=["greeting"]
-                    )
+    sources=["greeting"]
+)
 
-    # Help response
-    if any(pattern in query_lower for pattern in ['help', 'can you', 'what can you do']):
-        return QueryResponse(
-            text="""I'd be happy to help! Here's what I can do:
+HELP_RESPONSE = QueryResponse(
+    text="""I'd be happy to help! Here's what I can do:
 
                 1. Explain game rules in detail (e.g., "How do you play Battleship?")
                 2. Help navigate the platform (e.g., "How do I find a specific game?")
@@ -147,185 +134,509 @@ def get_general_response(query: str) -> QueryResponse:
                 4. Provide guidance on using the platform features
                 
                 What would you like to know more about?""",
-                            sources=["help"]
-                        )
+    sources=["help"]
+)
 
-    # Thanks response
-    if 'thank' in query_lower:
-        return QueryResponse(
-            text="You're welcome! Feel free to ask if you need anything else. 😊",
-            sources=["thanks"]
-        )
+THANKS_RESPONSE = QueryResponse(
+    text="You're welcome! Feel free to ask if you need anything else. 😊",
+    sources=["thanks"]
+)
 
-    # Default response
-    return QueryResponse(
-        text="""Hi there! I'm your Game Rules Assistant. I can help you with:
+DEFAULT_GENERAL_RESPONSE = QueryResponse(
+    text="""Hi there! I'm your Game Rules Assistant. I can help you with:
 
             1. Learning game rules
             2. Finding your way around the platform
             3. Answering general questions
             
             What would you like to know about?""",
-                    sources=["default"]
-                )
+    sources=["default"]
+)
 
 
-@retry(
-    stop=stop_after_attempt(MAX_RETRIES),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    reraise=True
-)
-async def call_llama_api(api_request_json: Dict) -> Dict:
-    """Make API call to LlamaAPI with retry logic and timing"""
-    try:
-        start_time = time.time()
+def get_general_response(query: str) -> QueryResponse:
+    """Pick the canned response for a general query"""
+    query_lower = query.lower().strip('?!., ')
 
-        # Use run_in_executor to make the synchronous API call
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: llama.run(api_request_json)
-        )
+    # Greeting response
+    if GREETING_PATTERN.search(query_lower):
+        return GREETING_RESPONSE
 
-        end_time = time.time()
-        elapsed_time = end_time - start_time
+    # Help response
+    if HELP_PATTERN.search(query_lower):
+        return HELP_RESPONSE
 
-        logger.info(f"API Response Time: {elapsed_time:.2f} seconds")
-        logger.info(f"API Response Status: {response.status_code}")
-        logger.info(f"API Response Content: {response.text}")
+    # Thanks response
+    if 'thank' in query_lower:
+        return THANKS_RESPONSE
 
-        if response.status_code != 200:
-            logger.error(f"LlamaAPI error: Status {response.status_code}")
-            raise Exception(f"API call failed with status {response.status_code}")
+    # Default response
+    return DEFAULT_GENERAL_RESPONSE
 
-        return response.json()
-    except Exception as e:
-        logger.error(f"Error calling LlamaAPI: {str(e)}")
-        raise
 
-async def query_rag(query_text: str) -> str:
+async def call_llama_api(api_request_json: Dict, deadline: Optional[Deadline] = None) -> Dict:
     """
-    Main query handling function
-
-    Args:
-        query_text: The user's query text
+    Make API call to LlamaAPI through the circuit breaker
 
-    Returns:
-        Formatted response string with text and sources
+    Each attempt's timeout is capped by what is left of the deadline, and a
+    failed attempt is retried after a short backoff only while at least
+    LLM_MIN_SECONDS would remain. Raises CircuitOpenError while the breaker
+    is open and DeadlineExceeded when there is no time left to try.
     """
-    try:
-        logger.info(f"Processing query: {query_text}")
+    deadline = deadline or Deadline()
+    breaker = get_llm_breaker()
+    for attempt in range(1, MAX_RETRIES + 1):
+        timeout = deadline.timeout(API_TIMEOUT)
+        if timeout < LLM_MIN_SECONDS:
+            raise DeadlineExceeded(f"{timeout:.1f}s left of the request deadline")
+        try:
+            return await breaker.call(
+                lambda: get_llm_client().complete(api_request_json, timeout=timeout)
+            )
+        except (LLMOverloadedError, CircuitOpenError):
+            raise
+        except Exception as e:
+            logger.error(f"Error calling LlamaAPI (attempt {attempt}): {str(e) or type(e).__name__}")
+            backoff = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            if attempt == MAX_RETRIES or deadline.remaining() - backoff < LLM_MIN_SECONDS:
+                raise
+            await asyncio.sleep(backoff)
+
+
+async def stream_llama_api(api_request_json: Dict, timeout: float = API_TIMEOUT) -> AsyncIterator[str]:
+    """Stream completion tokens from LlamaAPI"""
+    async for token in get_llm_client().stream(api_request_json, timeout=timeout):
+        yield token
+
+
+def source_label(metadata: Dict) -> str:
+    """"source:pageN" of a retrieved chunk; chunks without a page get the source alone"""
+    page = metadata.get("page")
+    source = metadata.get("source", "")
+    return source if page is None else f"{source}:page{page}"
+
+
+def build_api_request(query_text: str, context_text: str) -> Dict:
+    """Build the LlamaAPI request for a query and its assembled context"""
+    return {
+        "model": "llama3.1-70b",
+        "messages": [
+            {
+                "role": "system",
+                "content": """You are a knowledgeable and friendly gaming assistant. Provide clear, direct answers without referencing any 'context' or 'documents'. Be conversational but concise."""
+            },
+            {
+                 "role": "user",
+                "content": f"""Based on the following information, answer the user's question in a natural, conversational way:
 
-        # Handle general queries
-        if is_general_query(query_text) and not is_game_query(query_text):
-            logger.info("Processing as general query")
-            response = get_general_response(query_text)
-            logger.info(f"Response: {response.text}")
-            return response.format()
+        
+                    Context:
+                    {context_text}
 
-        # Initialize Chroma client
-        client = chromadb.PersistentClient(path=CHROMA_PATH)
+                    ---
 
-        # platform_collection = client.get_collection("platform_docs")
-        # all_platform_docs = platform_collection.get()
-        # print("Platform docs content:", all_platform_docs)
+                    Question: {query_text}
+                    
+                    Remember to use direct quotes from the context in your answer and only provide information that can be found in the context above.
+                    """
+            }
+        ],
+        "max_tokens": 512,
+        "stream": False,
+        "temperature": 0.7
+    }
+
+
+class PreparedQuery:
+    """Retrieval outcome: either a finished response or a request for the LLM"""
+
+    def __init__(self, query_text: str, timer: StageTimer, response: Optional[QueryResponse] = None,
+                 api_request_json: Optional[Dict] = None, sources: Optional[List[str]] = None,
+                 collection_name: Optional[str] = None, query_embedding=None,
+                 route: Optional[RouteDecision] = None, scores: Optional[List[float]] = None,
+                 passages: Optional[List[str]] = None, version: Optional[str] = None):
+        self.query_text = query_text
+        self.timer = timer
+        self.response = response
+        self.api_request_json = api_request_json
+        self.sources = sources or []
+        self.collection_name = collection_name
+        self.query_embedding = query_embedding
+        self.route = route
+        self.scores = scores
+        self.passages = passages or []
+        # Index version the context was retrieved from
+        self.version = version
+
+    async def remember(self, response: QueryResponse) -> None:
+        """Store a generated response in the response cache"""
+        await get_response_cache().put(
+            self.collection_name, self.query_text, self.query_embedding, response.to_dict(),
+            version=self.version, games=self.route.matched.get("game", ()) if self.route else ()
+        )
 
-        embedding_function = get_embedding_function()
+    def fallback(self, reason: str) -> QueryResponse:
+        """Degraded answer quoted from the retrieved passages, when the LLM cannot be used"""
+        text = extractive_answer(self.query_text, self.passages)
+        if text is None:
+            return API_ERROR_RESPONSE.copy(timings=self.timer.timings, route=self.route)
+        logger.warning(f"Serving extractive answer: {reason}")
+        return QueryResponse(
+            text, self.sources, self.timer.timings,
+            scores=self.scores, route=self.route, cache="extractive"
+        )
 
-        # Choose collection based on query type
-        collection_name = "platform_docs" if is_platform_query(query_text) else "game_rules"
 
-        # Initialize database connection
-        db = Chroma(
-            client=client,
-            collection_name=collection_name,
-            embedding_function=embedding_function,
+async def prepare_query(query_text: str, timer: Optional[StageTimer] = None,
+                        route: Optional[RouteDecision] = None, faq: bool = True) -> PreparedQuery:
+    """Classify, check the FAQ index and the cache, and retrieve context for a query"""
+    timer = timer or StageTimer()
+    logger.info(f"Processing query: {query_text}")
+
+    with timer.stage("classify"):
+        route = route or route_query(query_text)
+
+    # Handle general queries
+    if route.general:
+        logger.info("Processing as general query")
+        response = get_general_response(query_text)
+        logger.debug(f"Response: {response.text}")
+        return PreparedQuery(query_text, timer, response=response, route=route)
+
+    # Answer FAQ questions from the precomputed index, without the LLM
+    faq_index = get_faq_index() if faq else None
+    if faq_index is not None:
+        with timer.stage("faq"):
+            entry = faq_index.lookup_exact(query_text)
+        if entry is not None:
+            logger.info("Serving exact FAQ answer")
+            response = QueryResponse(entry["answer"], entry["sources"], cache="faq")
+            return PreparedQuery(query_text, timer, response=response, route=route)
+
+    # No topic pattern matched: let the embedding pick the collection
+    query_embedding = None
+    router = get_query_router()
+    if route.method == "default" and router.has_fallback and RETRIEVAL_MODE != "fanout":
+        with timer.stage("embed"):
+            query_embedding = await get_embedding_batcher().embed_query(query_text)
+        with timer.stage("classify"):
+            route = router.refine(route, query_embedding)
+    collection_name = route.collection
+    logger.info(f"Routed to {collection_name} ({route.kind}, by {route.method})")
+
+    # One lease for the whole query, taken before any handle is fetched: a
+    # version swapped in meanwhile is not used, and this one stays open
+    # until the prompt is built
+    context = get_retrieval_context()
+    with context.lease():
+        return await retrieve_context(query_text, timer, route, context, query_embedding, faq_index)
+
+
+async def retrieve_context(query_text: str, timer: StageTimer, route: RouteDecision,
+                           context: RetrievalContext, query_embedding=None,
+                           faq_index=None) -> PreparedQuery:
+    """Check the cache and retrieve context for a routed query, all from one leased index version"""
+    collection_name = route.collection
+
+    # Reuse the process-wide model, client and collection handle
+    with timer.stage("acquire"):
+        context.get_db(collection_name)
+
+    # Serve repeated questions from the response cache
+    cache = get_response_cache()
+    with timer.stage("cache"):
+        cached = await cache.get_exact(collection_name, query_text, context.version)
+    if cached is not None:
+        logger.info("Serving exact response cache hit")
+        response = QueryResponse.from_dict(cached).copy(cache="exact")
+        return PreparedQuery(query_text, timer, response=response, route=route)
+
+    # Embed through the shared micro-batcher, then search by vector
+    if query_embedding is None:
+        with timer.stage("embed"):
+            query_embedding = await get_embedding_batcher().embed_query(query_text)
+
+    if faq_index is not None:
+        with timer.stage("faq"):
+            entry = faq_index.lookup_similar(query_embedding, route.matched.get("game", ()))
+        if entry is not None:
+            logger.info("Serving similar FAQ answer")
+            response = QueryResponse(entry["answer"], entry["sources"], cache="faq")
+            return PreparedQuery(query_text, timer, response=response, route=route)
+
+    with timer.stage("cache"):
+        cached = await cache.get_similar(
+            collection_name, query_embedding, context.version, route.matched.get("game", ())
+        )
+    if cached is not None:
+        logger.info("Serving semantic response cache hit")
+        response = QueryResponse.from_dict(cached).copy(cache="semantic")
+        return PreparedQuery(query_text, timer, response=response, route=route)
+
+    logger.info("Searching database...")
+    with timer.stage("search"):
+        results = await search_collections(
+            collections_for(route), query_embedding, k=CONTEXT_FETCH_K, timer=timer,
+            query_text=query_text, context=context
         )
 
-        # Search the database
-        logger.info("Searching database...")
-        results = db.similarity_search_with_score(query_text, k=5)
-
-        logger.info("Search results:")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Search results:")
         for doc, score in results:
-            logger.info(f"Score: {score}")
-            logger.info(f"Content: {doc.page_content[:50]}...")  # First 50 chars
-            logger.info(f"Metadata: {doc.metadata}")
-            logger.info("---")
-
-        if not results:
-            logger.warning("No relevant results found")
-            return get_general_response(query_text).format()
-
-        # Prepare context
-        context_text = "\n\n---\n\n".join([doc.page_content for doc, _score in results])
-
-        # Prepare API request
-        system_content = (
-            "You are a helpful platform guide providing clear navigation assistance."
-            if is_platform_query(query_text)
-            else "You are a helpful assistant explaining game rules clearly and concisely."
+            logger.debug(f"Score: {score}")
+            logger.debug(f"Content: {doc.page_content[:50]}...")  # First 50 chars
+            logger.debug(f"Metadata: {doc.metadata}")
+            logger.debug("---")
+
+    if not results:
+        logger.warning("No relevant results found")
+        return PreparedQuery(query_text, timer, response=get_general_response(query_text), route=route)
+
+    with timer.stage("prompt"):
+        # Fit the least redundant chunks into the token budget
+        loop = asyncio.get_event_loop()
+        selection = await loop.run_in_executor(
+            None, lambda: build_context(query_embedding, results, context=context)
         )
+        # Get sources
+        sources = [source_label(doc.metadata) for doc, _score in selection.hits]
+        api_request_json = build_api_request(query_text, selection.text)
+
+    return PreparedQuery(
+        query_text,
+        timer,
+        api_request_json=api_request_json,
+        sources=sources,
+        collection_name=collection_name,
+        query_embedding=query_embedding,
+        route=route,
+        scores=[score for _doc, score in selection.hits],
+        passages=selection.passages,
+        version=context.version,
+    )
+
+
+API_ERROR_RESPONSE = QueryResponse(
+    "I apologize, but I'm having trouble processing your request right now. Please try again.",
+    ["error"]
+)
 
-        api_request_json = {
-            "model": "llama3.1-70b",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": """You are a knowledgeable and friendly gaming assistant. Provide clear, direct answers without referencing any 'context' or 'documents'. Be conversational but concise."""
-                },
-                {
-                     "role": "user",
-                    "content": f"""Based on the following information, answer the user's question in a natural, conversational way:
+SYSTEM_ERROR_RESPONSE = QueryResponse(
+    "I'm here to help! Please feel free to ask about game rules or how to use the platform.",
+    ["system_error"]
+)
 
-        
-                    Context:
-                    {context_text}
+OVERLOADED_RESPONSE = QueryResponse(
+    "The assistant is busy right now. Please try again shortly.",
+    ["overloaded"]
+)
 
-                    ---
 
-                    Question: {query_text}
-                    
-                    Remember to use direct quotes from the context in your answer and only provide information that can be found in the context above.
-                    """
-                }
-            ],
-            "max_tokens": 512,
-            "stream": False,
-            "temperature": 0.7
-        }
+async def is_cheap_query(query_text: str, route: Optional[RouteDecision] = None) -> bool:
+    """
+    Whether the query will be answered without retrieval or the LLM
+
+    True for general replies, exact FAQ answers and exact response cache
+    hits. Admission control lets these through ahead of full queries. Pass
+    the route the endpoint decided, so the query is classified only once.
+    """
+    route = route or route_query(query_text)
+    if route.general:
+        return True
+    faq_index = get_faq_index()
+    if faq_index is not None and faq_index.lookup_exact(query_text) is not None:
+        return True
+    if route.method == "default" and get_query_router().has_fallback and RETRIEVAL_MODE != "fanout":
+        # The collection, and so the cache key, is only known after embedding
+        return False
+    return await get_response_cache().has_exact(route.collection, query_text, get_retrieval_context().version)
+
+
+# Identical questions asked at the same time share one retrieval and LLM call
+query_flight = SingleFlight("query_rag")
+
+
+async def query_rag(query_text: str, route: Optional[RouteDecision] = None) -> QueryResponse:
+    """
+    Main query handling function
+
+    Args:
+        query_text: The user's query text
+        route: Its route, if the caller already classified it
+
+    Returns:
+        The structured response: text, sources, scores, route, cache status
+        and per-stage timings in seconds
+    """
+    route = route or route_query(query_text)
+    key = (normalize_query(query_text), route.collection)
+    response = await query_flight.do(key, lambda: answer_query(query_text, route))
+    # Coalesced callers share one response object; each gets its own copy
+    return response.copy()
+
+
+async def query_rag_batch(query_texts: List[str],
+                          routes: Optional[List[RouteDecision]] = None) -> List[QueryResponse]:
+    """
+    Answer many queries in one call, in order
+
+    Up to QUERY_BATCH_CONCURRENCY run at once, so their embeddings share
+    micro-batches and duplicates share one answer, without filling the LLM
+    queue on their own. Items shed by the LLM queue get OVERLOADED_RESPONSE
+    and the rest keep their answers; only a batch shed entirely raises
+    LLMOverloadedError.
+    """
+    semaphore = asyncio.Semaphore(QUERY_BATCH_CONCURRENCY)
+
+    async def answer(query_text: str, route: Optional[RouteDecision]) -> QueryResponse:
+        async with semaphore:
+            return await query_rag(query_text, route)
+
+    routes = routes or [None] * len(query_texts)
+    results = await asyncio.gather(
+        *[answer(query_text, route) for query_text, route in zip(query_texts, routes)], return_exceptions=True
+    )
+    if results and all(isinstance(result, LLMOverloadedError) for result in results):
+        raise results[0]
+
+    responses = []
+    for query_text, result in zip(query_texts, results):
+        if isinstance(result, LLMOverloadedError):
+            responses.append(OVERLOADED_RESPONSE.copy())
+        elif isinstance(result, asyncio.CancelledError):
+            raise result
+        elif isinstance(result, BaseException):
+            logger.error(f"Error answering batch item {query_text!r}: {result!r}")
+            responses.append(SYSTEM_ERROR_RESPONSE.copy())
+        else:
+            responses.append(result)
+    return responses
+
+
+async def answer_query(query_text: str, route: Optional[RouteDecision] = None) -> QueryResponse:
+    """Answer one query end to end; query_rag coalesces concurrent duplicates"""
+    timer = StageTimer()
+    # One budget for retrieval and generation together
+    deadline = Deadline()
+    try:
+        prepared = await asyncio.wait_for(prepare_query(query_text, timer, route), deadline.remaining())
+        route = prepared.route
+        if prepared.response is not None:
+            return prepared.response.copy(timings=timer.timings, route=route)
 
-        # Call API with timeout
+        # Call API within what is left of the deadline
         try:
-            response = await call_llama_api(api_request_json)
+            with timer.stage("llm"):
+                response = await call_llama_api(prepared.api_request_json, deadline)
             response_text = response['choices'][0]['message']['content']
 
-            # Get sources
-            sources = [
-                f"{doc.metadata['source']}:page{doc.metadata['page']}"
-                for doc, _score in results
-            ]
+            response = QueryResponse(
+                response_text, prepared.sources, timer.timings,
+                scores=prepared.scores, route=route, cache="miss"
+            )
+            await prepared.remember(response)
+            return response
 
-            return QueryResponse(response_text, sources).format()
+        except LLMOverloadedError:
+            raise
+
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            return prepared.fallback(str(e))
 
         except asyncio.TimeoutError:
             logger.error("API call timed out")
-            raise TimeoutError("Request timed out")
+            return prepared.fallback("LLM call timed out")
 
         except Exception as e:
             logger.error(f"Error in API call: {str(e)}")
-            return QueryResponse(
-                "I apologize, but I'm having trouble processing your request right now. Please try again.",
-                ["error"]
-            ).format()
+            return prepared.fallback(f"LLM call failed: {str(e)}")
+
+    except LLMOverloadedError:
+        # Surfaced to the endpoint as a fast 503
+        raise
 
     except Exception as e:
         logger.error(f"Error in query_rag: {str(e)}")
         logger.error(traceback.format_exc())
-        return QueryResponse(
-            "I'm here to help! Please feel free to ask about game rules or how to use the platform.",
-            ["system_error"]
-        ).format()
+        return SYSTEM_ERROR_RESPONSE.copy(timings=timer.timings, route=route)
+
+
+async def stream_query_rag(query_text: str, timer: Optional[StageTimer] = None,
+                           route: Optional[RouteDecision] = None) -> AsyncIterator[Dict]:
+    """
+    Streaming variant of query_rag
+
+    Yields events as dicts with "event" and "data" keys: "sources" right after
+    retrieval, one "token" per generated text fragment, then a terminal "done"
+    carrying the full response (preceded by "error" if generation failed).
+    """
+    timer = timer or StageTimer()
+    deadline = Deadline()
+    try:
+        prepared = await asyncio.wait_for(prepare_query(query_text, timer, route), deadline.remaining())
+    except Exception as e:
+        logger.error(f"Error in stream_query_rag: {str(e)}")
+        logger.error(traceback.format_exc())
+        prepared = PreparedQuery(query_text, timer, response=SYSTEM_ERROR_RESPONSE)
+
+    if prepared.response is not None:
+        yield {"event": "sources", "data": {"sources": prepared.response.sources}}
+        yield {"event": "token", "data": {"text": prepared.response.text}}
+        yield {"event": "done", "data": prepared.response.to_dict()}
+        return
+
+    yield {"event": "sources", "data": {"sources": prepared.sources}}
+
+    breaker = get_llm_breaker()
+    if deadline.remaining() < LLM_MIN_SECONDS or not breaker.allow():
+        fallback = prepared.fallback(f"breaker {breaker.state}, {deadline.remaining():.1f}s left")
+        yield {"event": "token", "data": {"text": fallback.text}}
+        yield {"event": "done", "data": fallback.to_dict()}
+        return
+
+    tokens = []
+    start = time.perf_counter()
+    first_token_at: Optional[float] = None
+
+    def latency() -> float:
+        """Time to first token, what the breaker compares against its slow threshold"""
+        return (first_token_at or time.perf_counter()) - start
+
+    try:
+        with timer.stage("llm"):
+            async for token in stream_llama_api(prepared.api_request_json, deadline.timeout(API_TIMEOUT)):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                tokens.append(token)
+                yield {"event": "token", "data": {"text": token}}
+    except LLMOverloadedError as e:
+        breaker.abandon()
+        logger.error(f"Error in streaming API call: {str(e)}")
+        yield {"event": "error", "data": {"message": API_ERROR_RESPONSE.text}}
+        yield {"event": "done", "data": API_ERROR_RESPONSE.to_dict()}
+        return
+    except Exception as e:
+        breaker.record(latency(), failed=True)
+        logger.error(f"Error in streaming API call: {str(e)}")
+        if not tokens:
+            # Nothing was sent yet, so the quoted answer can still stand in
+            fallback = prepared.fallback(f"LLM stream failed: {str(e)}")
+            yield {"event": "token", "data": {"text": fallback.text}}
+            yield {"event": "done", "data": fallback.to_dict()}
+            return
+        yield {"event": "error", "data": {"message": API_ERROR_RESPONSE.text}}
+        yield {"event": "done", "data": API_ERROR_RESPONSE.to_dict()}
+        return
+    except BaseException:
+        # The client went away mid-stream
+        breaker.abandon()
+        raise
+    # A long but healthy generation is not a slow upstream
+    breaker.record(latency(), failed=False)
+
+    response = QueryResponse("".join(tokens), prepared.sources, scores=prepared.scores, cache="miss")
+    await prepared.remember(response)
+    yield {"event": "done", "data": response.to_dict()}
 
 
 if __name__ == "__main__":
@@ -336,4 +647,4 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     # Run the query
-    asyncio.run(query_rag(args.query_text))
\ No newline at end of file
+    print(asyncio.run(query_rag(args.query_text)).format())
\ No newline at end of file
@@ -0,0 +1,192 @@
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import counter
+from retrieval_context import get_retrieval_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUERY_ROUTER_FALLBACK = os.getenv("QUERY_ROUTER_FALLBACK", "off")  # off or centroid
+
+GAME_COLLECTION = "game_rules"
+PLATFORM_COLLECTION = "platform_docs"
+
+# Query type patterns
+GENERAL_PATTERNS = [
+    'hello', 'hi', 'hey', 'help', 'can you', 'what can you do',
+    'who are you', 'how do you', 'thanks', 'thank you', 'bye'
+]
+
+GAME_PATTERNS = [
+    'battleship', 'battleships', 'chess', 'monopoly',
+    'reversi', 'tictactoe', 'tic-tac-toe'
+]
+
+PLATFORM_PATTERNS = [
+    'how to', 'where', 'find', 'navigate', 'use', 'access',
+    'menu', 'search', 'platform', 'website', 'guide', 'store',
+    'purchase', 'buy', 'game store', 'available games',
+    'list', 'account', 'create account'
+]
+
+ROUTE_DECISIONS = counter(
+    "query_routes_total",
+    "Routed queries by kind and by how the route was decided",
+)
+
+
+def compile_patterns(patterns: Iterable[str]) -> "re.Pattern":
+    """One case-insensitive alternation matching whole words and phrases only"""
+    # Longest first, so "game store" wins over "store" at the same position
+    ordered = sorted(set(patterns), key=len, reverse=True)
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(p) for p in ordered) + r")(?!\w)", re.IGNORECASE)
+
+
+class RouteDecision:
+    """
+    Where a query goes, decided once per request
+
+    kind is "general", "game" or "platform"; collection is None for general
+    queries. method says how the collection was picked: "patterns" when a
+    topic pattern matched, "centroid" when the embedding fallback chose it
+    and "default" when nothing matched and game_rules was assumed.
+    """
+
+    def __init__(self, kind: str, collection: Optional[str],
+                 matched: Dict[str, Tuple[str, ...]], method: str = "patterns"):
+        self.kind = kind
+        self.collection = collection
+        self.matched = matched
+        self.method = method
+
+    @property
+    def general(self) -> bool:
+        return self.kind == "general"
+
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        return {"kind": self.kind, "collection": self.collection, "method": self.method}
+
+    def __repr__(self) -> str:
+        return (
+            f"RouteDecision(kind={self.kind!r}, collection={self.collection!r}, "
+            f"method={self.method!r}, matched={self.matched!r})"
+        )
+
+
+class QueryRouter:
+    """
+    Single-pass pattern router with an optional nearest-centroid fallback
+
+    Every pattern of every category is compiled into one alternation with
+    word boundaries, so a query is scanned once and "hi" no longer matches
+    inside "chess". Game and platform matches take precedence over greetings.
+    """
+
+    def __init__(self, general_patterns: List[str] = GENERAL_PATTERNS,
+                 game_patterns: List[str] = GAME_PATTERNS,
+                 platform_patterns: List[str] = PLATFORM_PATTERNS,
+                 centroid_source: Optional[Callable[[], Dict[str, np.ndarray]]] = None):
+        self._categories: Dict[str, set] = {}
+        for kind, patterns in (("general", general_patterns), ("game", game_patterns),
+                               ("platform", platform_patterns)):
+            for pattern in patterns:
+                self._categories.setdefault(pattern.lower(), set()).add(kind)
+        self._pattern = compile_patterns(self._categories)
+        self._centroid_source = centroid_source
+
+    def matches(self, query: str) -> Dict[str, Tuple[str, ...]]:
+        """Patterns found in the query, by category"""
+        found: Dict[str, List[str]] = {}
+        for match in self._pattern.finditer(query):
+            text = match.group(0).lower()
+            for kind in self._categories[text]:
+                found.setdefault(kind, []).append(text)
+        return {kind: tuple(texts) for kind, texts in found.items()}
+
+    def route(self, query: str) -> RouteDecision:
+        """Classify a query from its patterns alone"""
+        matched = self.matches(query)
+        if "platform" in matched:
+            decision = RouteDecision("platform", PLATFORM_COLLECTION, matched)
+        elif "game" in matched:
+            decision = RouteDecision("game", GAME_COLLECTION, matched)
+        elif "general" in matched:
+            decision = RouteDecision("general", None, matched)
+        else:
+            decision = RouteDecision("game", GAME_COLLECTION, matched, method="default")
+        ROUTE_DECISIONS.inc(kind=decision.kind, method=decision.method)
+        logger.debug(f"Query '{query}' routed: {decision}")
+        return decision
+
+    @property
+    def has_fallback(self) -> bool:
+        return self._centroid_source is not None
+
+    def refine(self, decision: RouteDecision, query_embedding) -> RouteDecision:
+        """Pick the collection by nearest centroid when no topic pattern matched"""
+        if decision.method != "default" or self._centroid_source is None:
+            return decision
+        centroids = self._centroid_source()
+        if not centroids:
+            return decision
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        collection = max(centroids, key=lambda name: float(centroids[name] @ query))
+        kind = "platform" if collection == PLATFORM_COLLECTION else "game"
+        ROUTE_DECISIONS.inc(kind=kind, method="centroid")
+        return RouteDecision(kind, collection, decision.matched, method="centroid")
+
+
+class SnapshotCentroids:
+    """Mean unit embedding of each collection, from the vector index snapshots"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._centroids: Dict[str, Tuple[object, np.ndarray]] = {}
+
+    def __call__(self) -> Dict[str, np.ndarray]:
+        context = get_retrieval_context()
+        centroids = {}
+        for name in (GAME_COLLECTION, PLATFORM_COLLECTION):
+            index = context.get_vector_index(name)
+            if index is None or not len(index):
+                logger.warning(f"No vector index for {name}; centroid routing disabled")
+                return {}
+            with self._lock:
+                cached = self._centroids.get(name)
+                # Recompute after populate rewrites the snapshot
+                if cached is None or cached[0] is not index:
+                    rows = np.asarray(index.embeddings, dtype=np.float32)
+                    rows = rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+                    centroid = rows.mean(axis=0)
+                    cached = (index, centroid / max(float(np.linalg.norm(centroid)), 1e-12))
+                    self._centroids[name] = cached
+            centroids[name] = cached[1]
+        return centroids
+
+
+_router: Optional[QueryRouter] = None
+
+
+def get_query_router() -> QueryRouter:
+    """Return the process-wide query router"""
+    global _router
+    if _router is None:
+        centroid_source = SnapshotCentroids() if QUERY_ROUTER_FALLBACK == "centroid" else None
+        _router = QueryRouter(centroid_source=centroid_source)
+    return _router
+
+
+def route_query(query: str) -> RouteDecision:
+    """Classify a query with the process-wide router"""
+    return get_query_router().route(query)
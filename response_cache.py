@@ -0,0 +1,374 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import counter
+from retrieval_context import CHROMA_PATH
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory, redis or off
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+GENERATION_FILE = os.path.join(CHROMA_PATH, ".cache_generation")
+
+CACHE_REQUESTS = counter(
+    "response_cache_requests_total",
+    "Response cache lookups by tier and result",
+)
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query_text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", query_text.lower())).strip()
+
+
+def _unit(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+class InMemoryCacheBackend:
+    """Process-local LRU + TTL storage for both cache tiers"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = ""
+        self._lock = threading.Lock()
+        self._exact: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._semantic: Dict[str, "OrderedDict[str, Tuple[float, np.ndarray, Dict]]"] = {}
+        self._matrices: Dict[str, Tuple[List[str], np.ndarray]] = {}
+
+    async def get_exact(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.time():
+                del self._exact[key]
+                return None
+            self._exact.move_to_end(key)
+            return payload
+
+    async def set_exact(self, key: str, payload: Dict) -> None:
+        with self._lock:
+            self._exact[key] = (time.time() + self.ttl_seconds, payload)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+    async def find_similar(self, namespace: str, vector: np.ndarray, threshold: float) -> Optional[Dict]:
+        with self._lock:
+            entries = self._semantic.get(namespace)
+            if not entries:
+                return None
+
+            # Rebuild the stacked matrix only after the tier has changed
+            cached = self._matrices.get(namespace)
+            if cached is None:
+                keys = list(entries)
+                cached = (keys, np.stack([entries[k][1] for k in keys]))
+                self._matrices[namespace] = cached
+            keys, matrix = cached
+
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                return None
+
+            key = keys[best]
+            expires_at, _vector, payload = entries[key]
+            if expires_at < time.time():
+                del entries[key]
+                self._matrices.pop(namespace, None)
+                return None
+            entries.move_to_end(key)
+            return payload
+
+    async def add_semantic(self, namespace: str, key: str, vector: np.ndarray, payload: Dict) -> None:
+        with self._lock:
+            entries = self._semantic.setdefault(namespace, OrderedDict())
+            entries[key] = (time.time() + self.ttl_seconds, vector, payload)
+            entries.move_to_end(key)
+            now = time.time()
+            for stale in [k for k, (expires_at, _v, _p) in entries.items() if expires_at < now]:
+                del entries[stale]
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._matrices.pop(namespace, None)
+
+    async def clear(self) -> None:
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+            self._matrices.clear()
+
+    async def drop_versions(self, keep: Optional[str]) -> None:
+        """Drop entries answered from any index version but keep"""
+        with self._lock:
+            for key in [k for k in self._exact if namespace_version(k.split(":", 1)[0]) != keep]:
+                del self._exact[key]
+            for namespace in [n for n in self._semantic if namespace_version(n) != keep]:
+                del self._semantic[namespace]
+                self._matrices.pop(namespace, None)
+
+
+class RedisCacheBackend:
+    """Redis storage shared by every worker, bounded by per-tier LRU sorted sets"""
+
+    def __init__(self, url: str, max_entries: int, ttl_seconds: float, prefix: str = "chatcache"):
+        import redis.asyncio as redis
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.generation = ""
+        self._redis = redis.from_url(url)
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix, self.generation) + parts)
+
+    async def _touch(self, lru_key: str, member: str) -> List[bytes]:
+        """Record an access and return members evicted to stay within bounds"""
+        pipe = self._redis.pipeline()
+        pipe.zadd(lru_key, {member: time.time()})
+        pipe.expire(lru_key, int(self.ttl_seconds))
+        pipe.zcard(lru_key)
+        _added, _expire, size = await pipe.execute()
+        if size <= self.max_entries:
+            return []
+        return [m for m, _score in await self._redis.zpopmin(lru_key, size - self.max_entries)]
+
+    async def get_exact(self, key: str) -> Optional[Dict]:
+        raw = await self._redis.get(self._key("exact", key))
+        if raw is None:
+            return None
+        await self._touch(self._key("exact-lru"), key)
+        return json.loads(raw)
+
+    async def set_exact(self, key: str, payload: Dict) -> None:
+        await self._redis.set(self._key("exact", key), json.dumps(payload), ex=int(self.ttl_seconds))
+        evicted = await self._touch(self._key("exact-lru"), key)
+        if evicted:
+            await self._redis.delete(*[self._key("exact", m.decode()) for m in evicted])
+
+    async def find_similar(self, namespace: str, vector: np.ndarray, threshold: float) -> Optional[Dict]:
+        entries = await self._redis.hgetall(self._key("semantic", namespace))
+        if not entries:
+            return None
+
+        now = time.time()
+        best_key, best_payload, best_score = None, None, threshold
+        for member, raw in entries.items():
+            entry = json.loads(raw)
+            if entry["expires_at"] < now:
+                continue
+            score = float(np.dot(np.asarray(entry["vector"], dtype=np.float32), vector))
+            if score >= best_score:
+                best_key, best_payload, best_score = member, entry["payload"], score
+
+        if best_key is None:
+            return None
+        await self._touch(self._key("semantic-lru", namespace), best_key.decode())
+        return best_payload
+
+    async def add_semantic(self, namespace: str, key: str, vector: np.ndarray, payload: Dict) -> None:
+        hash_key = self._key("semantic", namespace)
+        entry = {
+            "expires_at": time.time() + self.ttl_seconds,
+            "vector": vector.tolist(),
+            "payload": payload,
+        }
+        await self._redis.hset(hash_key, key, json.dumps(entry))
+        await self._redis.expire(hash_key, int(self.ttl_seconds))
+        evicted = await self._touch(self._key("semantic-lru", namespace), key)
+        if evicted:
+            await self._redis.hdel(hash_key, *evicted)
+
+    async def clear(self) -> None:
+        # Keys of older generations are unreachable and expire through their TTL
+        pass
+
+    async def drop_versions(self, keep: Optional[str]) -> None:
+        # Shared with workers that may not have swapped yet; expire through their TTL
+        pass
+
+
+def cache_namespace(collection_name: str, version: Optional[str]) -> str:
+    """Key prefix of a collection's entries, per index version"""
+    return f"{collection_name}@{version}" if version else collection_name
+
+
+def semantic_namespace(collection_name: str, version: Optional[str], games: Tuple[str, ...] = ()) -> str:
+    """
+    Namespace of the semantic tier, per index version and games named
+
+    "How do I win at chess?" and "How do I win at Reversi?" embed close
+    together, so an answer is only reused for queries naming the same games.
+    """
+    namespace = cache_namespace(collection_name, version)
+    return f"{namespace}#{'+'.join(sorted(set(games)))}" if games else namespace
+
+
+def namespace_version(namespace: str) -> Optional[str]:
+    return namespace.partition("@")[2].partition("#")[0] or None
+
+
+class ResponseCache:
+    """
+    Exact and semantic response cache, invalidated when the collections are rebuilt
+
+    Entries are keyed by the index version they were answered from, so a
+    worker that swapped to a new version never reads answers that workers
+    still on the old one keep writing. Once lookups move to a new version,
+    entries of the others are dropped and answers from them are not stored.
+    """
+
+    def __init__(self, backend, similarity_threshold: float = RESPONSE_CACHE_SIMILARITY,
+                 generation_file: str = GENERATION_FILE):
+        self.backend = backend
+        self.similarity_threshold = similarity_threshold
+        self.generation_file = generation_file
+        self._generation = None
+        self._generation_mtime = None
+        self._version = None
+
+    async def _sync_generation(self) -> None:
+        """Drop every entry once populate_database.py has written a new generation"""
+        try:
+            mtime = os.stat(self.generation_file).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._generation_mtime and self._generation is not None:
+            return
+
+        generation = ""
+        if mtime is not None:
+            with open(self.generation_file) as f:
+                generation = f.read().strip()
+
+        if self._generation is not None and generation != self._generation:
+            logger.info("Collections rebuilt, invalidating response cache")
+            await self.backend.clear()
+        self._generation = generation
+        self._generation_mtime = mtime
+        self.backend.generation = generation
+
+    async def _sync_version(self, version: Optional[str]) -> None:
+        """Drop entries of other index versions once lookups come from a new one"""
+        if version != self._version:
+            if self._version is not None:
+                logger.info(f"Index version {self._version} -> {version}, dropping its cached responses")
+            self._version = version
+            await self.backend.drop_versions(version)
+
+    async def get_exact(self, collection_name: str, query_text: str,
+                        version: Optional[str] = None) -> Optional[Dict]:
+        """Look up a cached response by normalized query text"""
+        await self._sync_generation()
+        await self._sync_version(version)
+        namespace = cache_namespace(collection_name, version)
+        payload = await self.backend.get_exact(f"{namespace}:{normalize_query(query_text)}")
+        CACHE_REQUESTS.inc(tier="exact", result="hit" if payload else "miss")
+        return payload
+
+    async def has_exact(self, collection_name: str, query_text: str, version: Optional[str] = None) -> bool:
+        """Whether get_exact would hit, without counting a lookup"""
+        await self._sync_generation()
+        await self._sync_version(version)
+        namespace = cache_namespace(collection_name, version)
+        return await self.backend.get_exact(f"{namespace}:{normalize_query(query_text)}") is not None
+
+    async def get_similar(self, collection_name: str, query_embedding, version: Optional[str] = None,
+                          games: Tuple[str, ...] = ()) -> Optional[Dict]:
+        """Look up a cached response whose query embedding is close enough and names the same games"""
+        await self._sync_generation()
+        await self._sync_version(version)
+        payload = await self.backend.find_similar(
+            semantic_namespace(collection_name, version, games), _unit(query_embedding),
+            self.similarity_threshold
+        )
+        CACHE_REQUESTS.inc(tier="semantic", result="hit" if payload else "miss")
+        return payload
+
+    async def put(self, collection_name: str, query_text: str, query_embedding, payload: Dict,
+                  version: Optional[str] = None, games: Tuple[str, ...] = ()) -> None:
+        """Store a response in both tiers, under the index version it was answered from"""
+        await self._sync_generation()
+        if version != self._version:
+            # Answered from a version this process has swapped away from
+            return
+        namespace = cache_namespace(collection_name, version)
+        key = normalize_query(query_text)
+        await self.backend.set_exact(f"{namespace}:{key}", payload)
+        await self.backend.add_semantic(
+            semantic_namespace(collection_name, version, games), key, _unit(query_embedding), payload
+        )
+
+
+class NullResponseCache:
+    """Cache used when RESPONSE_CACHE_BACKEND=off"""
+
+    async def get_exact(self, collection_name: str, query_text: str,
+                        version: Optional[str] = None) -> Optional[Dict]:
+        return None
+
+    async def has_exact(self, collection_name: str, query_text: str, version: Optional[str] = None) -> bool:
+        return False
+
+    async def get_similar(self, collection_name: str, query_embedding, version: Optional[str] = None,
+                          games: Tuple[str, ...] = ()) -> Optional[Dict]:
+        return None
+
+    async def put(self, collection_name: str, query_text: str, query_embedding, payload: Dict,
+                  version: Optional[str] = None, games: Tuple[str, ...] = ()) -> None:
+        pass
+
+
+def invalidate_response_cache(generation_file: str = GENERATION_FILE) -> None:
+    """Write a new cache generation so every running cache drops its entries"""
+    os.makedirs(os.path.dirname(generation_file), exist_ok=True)
+    tmp_path = f"{generation_file}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, generation_file)
+    logger.info("Response cache invalidated")
+
+
+_cache = None
+
+
+def get_response_cache():
+    """Return the process-wide response cache for the configured backend"""
+    global _cache
+    if _cache is None:
+        if RESPONSE_CACHE_BACKEND == "off":
+            _cache = NullResponseCache()
+        elif RESPONSE_CACHE_BACKEND == "redis":
+            _cache = ResponseCache(RedisCacheBackend(
+                REDIS_URL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS
+            ))
+        else:
+            _cache = ResponseCache(InMemoryCacheBackend(
+                RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS
+            ))
+        logger.info(f"Response cache backend: {RESPONSE_CACHE_BACKEND}")
+    return _cache
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.documents import Document
+from chunk_store import ChunkRecord
+
+from metrics import StageTimer, histogram
+from query_router import RouteDecision
+from retrieval_context import COLLECTION_NAMES, RetrievalContext, get_retrieval_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "routed")  # routed or fanout
+RETRIEVAL_FUSION = os.getenv("RETRIEVAL_FUSION", "rrf")  # rrf or score
+# Squared L2 distance between unit embeddings, 2 - 2 * cosine; 1.6 drops
+# chunks with a cosine similarity below 0.2. Empty disables the cut-off.
+RETRIEVAL_MAX_DISTANCE = os.getenv("RETRIEVAL_MAX_DISTANCE", "1.6")
+RRF_K = int(os.getenv("RRF_K", "60"))
+# BM25 search next to the vector search; on or off
+RETRIEVAL_LEXICAL = os.getenv("RETRIEVAL_LEXICAL", "on")
+
+COLLECTION_SEARCH_SECONDS = histogram(
+    "retrieval_collection_search_seconds",
+    "Vector search latency per collection",
+)
+LEXICAL_SEARCH_SECONDS = histogram(
+    "retrieval_lexical_search_seconds",
+    "BM25 search latency per collection",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+
+# Chroma returns Documents, the numpy index ChunkRecords; both have page_content, id and metadata
+Hit = Tuple[Union[Document, ChunkRecord], float]
+
+
+def max_distance() -> Optional[float]:
+    return float(RETRIEVAL_MAX_DISTANCE) if RETRIEVAL_MAX_DISTANCE else None
+
+
+def collections_for(route: RouteDecision, mode: str = RETRIEVAL_MODE) -> Sequence[str]:
+    """Collections searched for a routed query"""
+    if mode == "fanout":
+        return COLLECTION_NAMES
+    return (route.collection,)
+
+
+def filter_hits(hits: List[Hit], threshold: Optional[float]) -> List[Hit]:
+    """Drop hits whose distance is above the threshold"""
+    if threshold is None:
+        return hits
+    return [(doc, score) for doc, score in hits if score <= threshold]
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Hit]], k: int, rrf_k: int = RRF_K) -> List[Hit]:
+    """Merge ranked hit lists by the sum of 1 / (rrf_k + rank)"""
+    fused: Dict[str, float] = {}
+    best: Dict[str, Hit] = {}
+    for hits in ranked_lists:
+        for rank, (doc, score) in enumerate(hits, start=1):
+            key = doc.id or doc.metadata.get("id") or doc.page_content
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            if key not in best or score < best[key][1]:
+                best[key] = (doc, score)
+    order = sorted(fused, key=lambda key: (-fused[key], best[key][1]))
+    return [best[key] for key in order[:k]]
+
+
+def score_fusion(ranked_lists: List[List[Hit]], k: int) -> List[Hit]:
+    """
+    Merge hit lists by distance
+
+    Every collection is embedded with the same model, so distances are
+    directly comparable; this keeps the nearest k chunks overall.
+    """
+    best: Dict[str, Hit] = {}
+    for hits in ranked_lists:
+        for doc, score in hits:
+            key = doc.id or doc.metadata.get("id") or doc.page_content
+            if key not in best or score < best[key][1]:
+                best[key] = (doc, score)
+    return sorted(best.values(), key=lambda hit: hit[1])[:k]
+
+
+def fuse(ranked_lists: List[List[Hit]], k: int, method: str = RETRIEVAL_FUSION) -> List[Hit]:
+    if len(ranked_lists) == 1:
+        return ranked_lists[0][:k]
+    if method == "score":
+        return score_fusion(ranked_lists, k)
+    return reciprocal_rank_fusion(ranked_lists, k)
+
+
+async def search_collections(collection_names: Sequence[str], query_embedding: List[float],
+                             k: int = 5, timer: Optional[StageTimer] = None,
+                             query_text: Optional[str] = None,
+                             lexical: bool = RETRIEVAL_LEXICAL == "on",
+                             context: Optional[RetrievalContext] = None) -> List[Hit]:
+    """
+    Search collections concurrently with one query embedding
+
+    With query_text, each collection's BM25 index is searched alongside,
+    which finds exact game terms the embeddings rank poorly. Returns at most
+    k (Document, distance) pairs after the distance cut-off, which applies
+    to vector hits only, and fusion across collections and searches.
+    Searches the given context, by default the current one.
+    """
+    context = context or get_retrieval_context()
+    loop = asyncio.get_event_loop()
+
+    def search_one(name: str) -> Tuple[List[Hit], float]:
+        start = time.perf_counter()
+        hits = context.search_by_vector(name, query_embedding, k=k)
+        return hits, time.perf_counter() - start
+
+    def search_lexical(name: str) -> Tuple[List[Hit], float]:
+        start = time.perf_counter()
+        hits = context.search_lexical(name, query_text, query_embedding, k=k)
+        return hits, time.perf_counter() - start
+
+    lexical_names = collection_names if lexical and query_text else ()
+    # An index swap mid-search closes the old version only after this
+    with context.lease():
+        outcomes = await asyncio.gather(*[
+            loop.run_in_executor(None, search_one, name) for name in collection_names
+        ], *[
+            loop.run_in_executor(None, search_lexical, name) for name in lexical_names
+        ])
+    lexical_outcomes = outcomes[len(collection_names):]
+    outcomes = outcomes[:len(collection_names)]
+
+    threshold = max_distance()
+    ranked_lists = []
+    for name, (hits, elapsed) in zip(collection_names, outcomes):
+        COLLECTION_SEARCH_SECONDS.observe(elapsed, collection=name)
+        if timer is not None:
+            timer.timings[f"search_{name}"] = elapsed
+        for doc, _score in hits:
+            doc.metadata.setdefault("collection", name)
+        kept = filter_hits(hits, threshold)
+        if len(kept) < len(hits):
+            logger.info(f"Dropped {len(hits) - len(kept)} {name} chunks above distance {threshold}")
+        ranked_lists.append(kept)
+
+    for name, (hits, elapsed) in zip(lexical_names, lexical_outcomes):
+        LEXICAL_SEARCH_SECONDS.observe(elapsed, collection=name)
+        if timer is not None:
+            timer.timings[f"lexical_{name}"] = elapsed
+        if hits:
+            for doc, _score in hits:
+                doc.metadata.setdefault("collection", name)
+            ranked_lists.append(hits)
+
+    return fuse(ranked_lists, k)
@@ -0,0 +1,385 @@
+import asyncio
+import logging
+import os
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import chromadb
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+from chromadb.config import Settings
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from chunk_store import ChunkRecord
+from get_embedding_function import get_embedding_function
+from index_versions import CHROMA_PATH, current_version, record_serving, version_path
+from lexical_index import LexicalIndex, lexical_index_path
+from vector_index import VectorIndex, snapshot_paths
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAMES = ("game_rules", "platform_docs")
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")  # chroma or numpy
+INDEX_WATCH_SECONDS = float(os.getenv("INDEX_WATCH_SECONDS", "5"))  # 0 disables the watcher
+
+
+class RetrievalContext:
+    """
+    Process-wide embedding model, Chroma client and collection handles
+
+    The embedding model may be loaded before the process forks (gunicorn
+    --preload) and is then shared copy-on-write by every worker. The Chroma
+    client is per process: a forked child drops the handles it inherited and
+    opens its own. A read-only context never writes to the collections.
+    With the numpy backend, searches go to memory-mapped snapshots of the
+    collections and fall back to Chroma while a snapshot is missing.
+    Lexical searches use the BM25 index written next to the snapshots.
+
+    A context serves one index version, by default the one the pointer file
+    names when it is created. reload_retrieval_context() swaps in a context
+    for a newer version; the old one closes once its leases are released.
+    """
+
+    def __init__(self, chroma_path: Optional[str] = None, read_only: bool = False,
+                 backend: str = RETRIEVAL_BACKEND, version: Optional[str] = None):
+        if chroma_path is None:
+            version = version or current_version()
+            chroma_path = version_path(version)
+        self.chroma_path = chroma_path
+        self.version = version
+        self.read_only = read_only
+        self.backend = backend
+        self.index_path = os.path.join(chroma_path, "vector_index")
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._embedding_function = None
+        self._client = None
+        self._collections: Dict[str, Chroma] = {}
+        self._indexes: Dict[str, Tuple[float, VectorIndex]] = {}
+        self._lexical_indexes: Dict[str, Tuple[float, LexicalIndex]] = {}
+        self._in_flight = 0
+        self._retired = False
+
+    def for_version(self, version: Optional[str], chroma_path: Optional[str] = None) -> "RetrievalContext":
+        """A context with the same settings on another index version, sharing the model if loaded"""
+        context = RetrievalContext(chroma_path, self.read_only, self.backend, version)
+        context._embedding_function = self._embedding_function
+        return context
+
+    def _check_fork(self) -> None:
+        """Forget Chroma handles inherited from a parent process"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._client = None
+            self._collections = {}
+            self._in_flight = 0
+            SharedSystemClient.clear_system_cache()
+
+    def preload(self) -> None:
+        """Load only the embedding model; safe to call before forking workers"""
+        self.embedding_function
+
+    @property
+    def ready(self) -> bool:
+        """Whether the model, client and every collection handle are loaded"""
+        self._check_fork()
+        return (
+            self._embedding_function is not None
+            and self._client is not None
+            and all(name in self._collections for name in COLLECTION_NAMES)
+        )
+
+    def initialize(self) -> None:
+        """Load the embedding model, open the client and every collection"""
+        try:
+            for name in COLLECTION_NAMES:
+                self.get_db(name)
+                if self.backend == "numpy":
+                    self.get_vector_index(name)
+                self.get_lexical_index(name)
+            logger.info(f"Retrieval context ready: {', '.join(COLLECTION_NAMES)}")
+        except Exception as e:
+            logger.error(f"Error initializing retrieval context: {e}")
+            logger.error(traceback.format_exc())
+            raise
+
+    @contextmanager
+    def lease(self) -> Iterator["RetrievalContext"]:
+        """Hold the context open for one query, even if a newer version is swapped in"""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                drained = self._retired and not self._in_flight
+            if drained:
+                self.close()
+
+    def retire(self) -> None:
+        """Close the context once the queries still using it finish"""
+        with self._lock:
+            self._retired = True
+            drained = not self._in_flight
+        if drained:
+            self.close()
+
+    def close(self) -> None:
+        """Release the Chroma client and the loaded indexes; the model is shared and kept"""
+        with self._lock:
+            client, self._client = self._client, None
+            self._collections = {}
+            self._indexes = {}
+            self._lexical_indexes = {}
+        if client is not None and hasattr(client, "close"):
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"Error closing Chroma client at {self.chroma_path}: {e}")
+        logger.info(f"Closed retrieval context for index version {self.version or 'unversioned'}")
+
+    @property
+    def embedding_function(self):
+        """Shared embedding model, loaded once per process"""
+        if self._embedding_function is None:
+            with self._lock:
+                if self._embedding_function is None:
+                    logger.info("Loading embedding model...")
+                    self._embedding_function = get_embedding_function()
+        return self._embedding_function
+
+    @property
+    def client(self):
+        """Shared Chroma client, opened once per process"""
+        self._check_fork()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    mode = "read-only" if self.read_only else "read-write"
+                    logger.info(f"Opening {mode} Chroma client at {self.chroma_path} (pid {self._pid})")
+                    self._client = chromadb.PersistentClient(
+                        path=self.chroma_path,
+                        settings=Settings(anonymized_telemetry=False, allow_reset=not self.read_only),
+                    )
+        return self._client
+
+    def get_db(self, collection_name: str) -> Chroma:
+        """Return the shared Chroma handle for a collection"""
+        self._check_fork()
+        db = self._collections.get(collection_name)
+        if db is None:
+            embedding_function = self.embedding_function
+            client = self.client
+            with self._lock:
+                db = self._collections.get(collection_name)
+                if db is None:
+                    db = Chroma(
+                        client=client,
+                        collection_name=collection_name,
+                        embedding_function=embedding_function,
+                    )
+                    self._collections[collection_name] = db
+        return db
+
+    def get_collection(self, collection_name: str):
+        """Return the raw Chroma collection, for writes with precomputed embeddings"""
+        if self.read_only:
+            raise RuntimeError("Retrieval context is read-only; run populate_database.py to write")
+        return self.get_db(collection_name)._collection
+
+    def get_vector_index(self, collection_name: str) -> Optional[VectorIndex]:
+        """Return the collection snapshot, reloading it after populate rewrites it"""
+        matrix_path, _rows_path = snapshot_paths(self.index_path, collection_name)
+        try:
+            mtime = os.stat(matrix_path).st_mtime
+        except FileNotFoundError:
+            return None
+        cached = self._indexes.get(collection_name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self._lock:
+            cached = self._indexes.get(collection_name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            try:
+                index = VectorIndex.load(self.index_path, collection_name)
+            except Exception as e:
+                # Most likely caught between the two file replacements
+                logger.warning(f"Could not load vector index for {collection_name}: {e}")
+                return cached[1] if cached is not None else None
+            logger.info(f"Loaded vector index for {collection_name}: {len(index)} vectors")
+            self._indexes[collection_name] = (mtime, index)
+            return index
+
+    def get_lexical_index(self, collection_name: str) -> Optional[LexicalIndex]:
+        """Return the collection's BM25 index, reloading it after populate rewrites it"""
+        path = lexical_index_path(self.index_path, collection_name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        cached = self._lexical_indexes.get(collection_name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self._lock:
+            cached = self._lexical_indexes.get(collection_name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            try:
+                index = LexicalIndex.load(self.index_path, collection_name)
+            except Exception as e:
+                logger.warning(f"Could not load BM25 index for {collection_name}: {e}")
+                return cached[1] if cached is not None else None
+            logger.info(f"Loaded BM25 index for {collection_name}: {len(index.terms)} terms")
+            self._lexical_indexes[collection_name] = (mtime, index)
+            return index
+
+    def search_lexical(self, collection_name: str, query_text: str, query_embedding: List[float],
+                       k: int = 5) -> List[Tuple[Union[Document, ChunkRecord], float]]:
+        """
+        Top-k BM25 matches as (Document or ChunkRecord, distance) pairs, best BM25 score first
+
+        The distance is the chunk's squared L2 distance to the query
+        embedding, as from search_by_vector, so lexical and vector hits can
+        be fused and filtered alike; the BM25 score is in metadata["bm25"].
+        """
+        lexical_index = self.get_lexical_index(collection_name)
+        if lexical_index is None:
+            return []
+        matches = lexical_index.search(query_text, k=k)
+        if not matches:
+            return []
+        ids = [chunk_id for chunk_id, _score in matches]
+        index = self.get_vector_index(collection_name)
+        if index is not None and all(chunk_id in index.rows for chunk_id in ids):
+            hits = index.hits(ids, query_embedding)
+        else:
+            result = self.get_db(collection_name).get(
+                ids=ids, include=["documents", "metadatas", "embeddings"]
+            )
+            query = np.asarray(query_embedding, dtype=np.float32)
+            by_id = {
+                chunk_id: (document, metadata, np.asarray(embedding, dtype=np.float32))
+                for chunk_id, document, metadata, embedding in zip(
+                    result["ids"], result["documents"], result["metadatas"], result["embeddings"]
+                )
+            }
+            hits = [
+                (
+                    Document(page_content=by_id[chunk_id][0], metadata=dict(by_id[chunk_id][1] or {}), id=chunk_id),
+                    float(np.sum((by_id[chunk_id][2] - query) ** 2)),
+                )
+                for chunk_id in ids if chunk_id in by_id
+            ]
+        bm25 = dict(matches)
+        for doc, _distance in hits:
+            doc.metadata["bm25"] = bm25[doc.id]
+        return hits
+
+    def search_by_vector(self, collection_name: str, query_embedding: List[float],
+                         k: int = 5) -> List[Tuple[Union[Document, ChunkRecord], float]]:
+        """Top-k (Document or ChunkRecord, distance) pairs from the configured backend"""
+        if self.backend == "numpy":
+            index = self.get_vector_index(collection_name)
+            if index is not None:
+                return index.search(query_embedding, k=k)
+            logger.warning(f"No vector index for {collection_name}; searching Chroma")
+        db = self.get_db(collection_name)
+        return db.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k)
+
+    def get_embeddings(self, collection_name: str, ids: List[str]) -> np.ndarray:
+        """Stored embeddings of chunks, in the order of ids"""
+        if self.backend == "numpy":
+            index = self.get_vector_index(collection_name)
+            if index is not None:
+                return index.vectors(ids)
+        result = self.get_db(collection_name).get(ids=ids, include=["embeddings"])
+        by_id = dict(zip(result["ids"], result["embeddings"]))
+        return np.asarray([by_id[chunk_id] for chunk_id in ids], dtype=np.float32)
+
+
+_context: Optional[RetrievalContext] = None
+_context_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+
+def get_retrieval_context(read_only: bool = False) -> RetrievalContext:
+    """Return the process-wide retrieval context; read_only applies when it is first created"""
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = RetrievalContext(read_only=read_only)
+    return _context
+
+
+def set_retrieval_context(context: RetrievalContext) -> None:
+    """Replace the process-wide context, e.g. to write an index version being built"""
+    global _context
+    with _context_lock:
+        _context = context
+
+
+def reload_retrieval_context() -> bool:
+    """
+    Switch to the index version the pointer names; True if it changed
+
+    The new context loads its client and indexes before it replaces the old
+    one, so queries never see a cold or half-built index. Queries already
+    running keep their lease on the old context, which closes after them.
+    Blocking; call it off the event loop.
+    """
+    with _reload_lock:
+        previous = get_retrieval_context(read_only=True)
+        version = current_version()
+        if version == previous.version:
+            return False
+        context = previous.for_version(version)
+        context.initialize()
+        set_retrieval_context(context)
+    logger.info(f"Swapped index version {previous.version or 'unversioned'} -> {version}")
+    previous.retire()
+    return True
+
+
+def heartbeat_serving() -> None:
+    """Refresh this process's serving record, which keeps its version from garbage collection"""
+    try:
+        record_serving(get_retrieval_context().version)
+    except OSError as e:
+        logger.warning(f"Could not record the served index version: {e}")
+
+
+async def watch_index_versions(interval: float = INDEX_WATCH_SECONDS) -> None:
+    """
+    Poll the pointer file and hot-swap to each newly published version
+
+    Each tick also refreshes the serving record. A failed swap is retried on
+    the next tick, and the version still served meanwhile is not deleted.
+    """
+    loop = asyncio.get_event_loop()
+    failed_version = None
+    while True:
+        heartbeat_serving()
+        await asyncio.sleep(interval)
+        version = current_version()
+        if version == get_retrieval_context().version:
+            continue
+        try:
+            await loop.run_in_executor(None, reload_retrieval_context)
+            failed_version = None
+            heartbeat_serving()
+        except Exception as e:
+            # Keep serving the current version and retry on the next tick
+            if version != failed_version:
+                logger.error(f"Could not switch to index version {version}: {e}")
+                logger.error(traceback.format_exc())
+            else:
+                logger.warning(f"Still cannot switch to index version {version}: {e}")
+            failed_version = version
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from metrics import counter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+COALESCED_REQUESTS = counter(
+    "singleflight_coalesced_total",
+    "Calls that awaited an identical in-flight call instead of running their own",
+)
+
+
+class SingleFlight:
+    """Run one call per key at a time and share its result with concurrent duplicates"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await fn(), or the already running call for the same key"""
+        task = self._calls.get(key)
+        if task is not None:
+            COALESCED_REQUESTS.inc(name=self.name)
+            logger.debug(f"Coalesced {self.name} call for {key!r}")
+        else:
+            # A separate task, so one caller disconnecting does not cancel the others
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _task: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
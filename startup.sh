@@ -2,10 +2,4 @@
 set -x  # Enable debug mode
 cd /app
 echo "Starting gunicorn..."
-gunicorn app.main:app \
-    --workers 1 \
-    --worker-class uvicorn.workers.UvicornWorker \
-    --timeout 600 \
-    --bind 0.0.0.0:8000 \
-    --log-level debug \
-    --preload
\ No newline at end of file
+gunicorn app.main:app -c gunicorn.conf.py
\ No newline at end of file
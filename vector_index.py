@@ -0,0 +1,131 @@
+import logging
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from chunk_store import ChunkRecord, ChunkStore, chunk_store_paths, write_chunk_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FETCH_SIZE = 1000
+
+
+def snapshot_paths(directory: str, collection_name: str) -> Tuple[str, str]:
+    """Embedding matrix and chunk row table files of a collection snapshot"""
+    return os.path.join(directory, f"{collection_name}.npy"), chunk_store_paths(directory, collection_name)[1]
+
+
+def write_snapshot(collection, directory: str) -> int:
+    """Dump a Chroma collection's embeddings, documents and metadata to disk"""
+    ids: List[str] = []
+    documents: List[str] = []
+    metadatas: List[Dict] = []
+    embeddings = []
+    total = collection.count()
+    for offset in range(0, total, SNAPSHOT_FETCH_SIZE):
+        batch = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=SNAPSHOT_FETCH_SIZE,
+            offset=offset,
+        )
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(meta or {} for meta in batch["metadatas"])
+        embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+
+    matrix = np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    os.makedirs(directory, exist_ok=True)
+    matrix_path, _rows_path = snapshot_paths(directory, collection.name)
+
+    # Replace the chunk store before the matrix: readers reload on the
+    # matrix mtime and reject a pair whose row counts disagree
+    write_chunk_store(directory, collection.name, ids, documents, metadatas)
+    with open(f"{matrix_path}.tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix))
+    os.replace(f"{matrix_path}.tmp", matrix_path)
+
+    logger.info(f"Wrote {len(ids)} vectors of {collection.name} to {matrix_path}")
+    return len(ids)
+
+
+class VectorIndex:
+    """
+    Exact nearest-neighbour search over one collection snapshot
+
+    The embeddings are memory-mapped as a contiguous float32 matrix and
+    scored with a single matrix product. Scores are squared L2 distances,
+    the same values Chroma returns, so lower is more similar. Hits are
+    ChunkRecords reading text and metadata from the memory-mapped chunk
+    store.
+    """
+
+    def __init__(self, name: str, embeddings: np.ndarray, chunks: ChunkStore):
+        if embeddings.shape[0] != len(chunks):
+            raise ValueError(
+                f"Snapshot of {name} has {embeddings.shape[0]} vectors but {len(chunks)} rows"
+            )
+        self.name = name
+        self.embeddings = embeddings
+        self.chunks = chunks
+        self.ids = chunks.ids()
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.squared_norms = np.einsum("ij,ij->i", embeddings, embeddings) if len(chunks) else np.zeros(0)
+
+    @classmethod
+    def load(cls, directory: str, collection_name: str) -> "VectorIndex":
+        """Memory-map a snapshot written by write_snapshot"""
+        matrix_path, _rows_path = snapshot_paths(directory, collection_name)
+        embeddings = np.load(matrix_path, mmap_mode="r")
+        return cls(collection_name, embeddings, ChunkStore.load(directory, collection_name))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def vectors(self, ids: Sequence[str]) -> np.ndarray:
+        """Stored embeddings of the given chunk IDs, in order"""
+        return np.asarray(self.embeddings[[self.rows[chunk_id] for chunk_id in ids]], dtype=np.float32)
+
+    def hits(self, ids: Sequence[str], query_embedding: Sequence[float]) -> List[Tuple[ChunkRecord, float]]:
+        """Chunks and squared L2 distances of the given chunk IDs, in order"""
+        rows = [self.rows[chunk_id] for chunk_id in ids]
+        if not rows:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        distances = self.squared_norms[rows] - 2.0 * (self.embeddings[rows] @ query) + query @ query
+        return [(ChunkRecord(self.chunks, row), float(max(distance, 0.0))) for row, distance in zip(rows, distances)]
+
+    def _top_k(self, distances: np.ndarray, k: int) -> List[Tuple[ChunkRecord, float]]:
+        if k < len(distances):
+            rows = np.argpartition(distances, k)[:k]
+        else:
+            rows = np.arange(len(distances))
+        rows = rows[np.argsort(distances[rows], kind="stable")]
+        return [(ChunkRecord(self.chunks, int(row)), float(distances[row])) for row in rows]
+
+    def search(self, query_embedding: Sequence[float], k: int = 5) -> List[Tuple[ChunkRecord, float]]:
+        """Top-k chunks and squared L2 distances for one query"""
+        if not len(self.ids):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        # In place, so a search allocates one distance array instead of four
+        distances = self.embeddings @ query
+        distances *= -2.0
+        distances += self.squared_norms
+        distances += query @ query
+        return self._top_k(np.maximum(distances, 0.0, out=distances), k)
+
+    def search_batch(self, query_embeddings: Sequence[Sequence[float]],
+                     k: int = 5) -> List[List[Tuple[ChunkRecord, float]]]:
+        """Top-k chunks for several queries with one matrix-matrix product"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if not len(self.ids):
+            return [[] for _ in range(len(queries))]
+        distances = (
+            self.squared_norms[None, :]
+            - 2.0 * (queries @ self.embeddings.T)
+            + np.einsum("ij,ij->i", queries, queries)[:, None]
+        )
+        return [self._top_k(np.maximum(row, 0.0), k) for row in distances]
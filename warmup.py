@@ -0,0 +1,174 @@
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import histogram
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set to a file path to write the startup profile as JSON, or to "log"
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE")
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", "60"))
+
+# Imported one by one so the profile shows where import time goes; shared
+# dependencies are charged to the first module that pulls them in
+HEAVY_MODULES = (
+    "numpy",
+    "httpx",
+    "langchain_core.documents",
+    "chromadb",
+    "langchain_chroma",
+    "get_embedding_function",
+    "query_data",
+)
+
+PROCESS_STARTED = time.time()
+
+STARTUP_SECONDS = histogram(
+    "startup_seconds",
+    "Warmup duration and time from app import to the first successful chat",
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+
+
+class StartupProfile:
+    """Import and initialization timings of one process start"""
+
+    def __init__(self):
+        self.imports: Dict[str, float] = {}
+        self.steps: Dict[str, float] = {}
+        self.first_chat_s: Optional[float] = None
+
+    @contextmanager
+    def step(self, name: str, kind: str = "steps"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            getattr(self, kind)[name] = time.perf_counter() - start
+
+    def report(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "imports_s": self.imports,
+            "init_s": self.steps,
+            "import_total_s": sum(self.imports.values()),
+            "init_total_s": sum(self.steps.values()),
+            "first_chat_s": self.first_chat_s,
+        }
+
+    def dump(self) -> None:
+        if not STARTUP_PROFILE:
+            return
+        report = self.report()
+        if STARTUP_PROFILE == "log":
+            logger.info(f"Startup profile: {json.dumps(report)}")
+            return
+        path = STARTUP_PROFILE.replace("{pid}", str(os.getpid()))
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Startup profile written to {path}")
+
+
+class Warmup:
+    """
+    Background import and model load, started once the server is listening
+
+    state moves from "pending" to "warming" to "ready", or to "failed" with
+    the error kept for /health. Requests arriving while warming wait for it.
+    """
+
+    def __init__(self):
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.profile = StartupProfile()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self) -> asyncio.Task:
+        """Schedule the warmup on the running event loop"""
+        if self._task is None:
+            self.state = "warming"
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    async def _run(self) -> None:
+        start = time.perf_counter()
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._warm)
+            self.state = "ready"
+            elapsed = time.perf_counter() - start
+            STARTUP_SECONDS.observe(elapsed, phase="warmup")
+            logger.info(f"Warmup finished in {elapsed:.2f}s")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"Warmup failed: {e}")
+            logger.error(traceback.format_exc())
+        finally:
+            self.profile.dump()
+
+    def _warm(self) -> None:
+        profile = self.profile
+        for module in HEAVY_MODULES:
+            with profile.step(module, kind="imports"):
+                importlib.import_module(module)
+
+        from faq_index import get_faq_index
+        from retrieval_context import get_retrieval_context
+
+        # Read-only, once per worker; a no-op for parts preloaded before fork
+        context = get_retrieval_context(read_only=True)
+        with profile.step("embedding_model"):
+            context.preload()
+        with profile.step("retrieval_context"):
+            context.initialize()
+        with profile.step("faq_index"):
+            get_faq_index()
+        # The first inference pays for lazy kernel and allocator setup
+        with profile.step("first_embedding"):
+            context.embedding_function.embed_query("warmup")
+
+    async def wait_ready(self, timeout: float = WARMUP_WAIT_SECONDS) -> bool:
+        """Wait for a running warmup; False if it failed or took too long"""
+        if self._task is None:
+            self.start()
+        if not self._task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self.ready
+
+    def record_first_chat(self) -> None:
+        """Note the time from app import to the first successful chat, once"""
+        if self.profile.first_chat_s is not None:
+            return
+        elapsed = time.time() - PROCESS_STARTED
+        self.profile.first_chat_s = elapsed
+        STARTUP_SECONDS.observe(elapsed, phase="first_chat")
+        logger.info(f"First successful chat {elapsed:.2f}s after startup")
+        self.profile.dump()
+
+
+_warmup: Optional[Warmup] = None
+
+
+def get_warmup() -> Warmup:
+    """Return the process-wide warmup"""
+    global _warmup
+    if _warmup is None:
+        _warmup = Warmup()
+    return _warmup